@@ -0,0 +1,86 @@
+import time
+import threading
+
+# AIMD (additive increase, multiplicative decrease) concurrency control for parallel fetches
+# The number of requests allowed in flight grows by about one per round trip while responses come back
+# fast and clean, and is cut in half when the upstream answers with 429/5xx, times out or slows down
+
+INITIAL_LIMIT = 2
+MIN_LIMIT = 1
+DECREASE_FACTOR = 0.5   # multiply the limit by this on congestion
+LATENCY_FACTOR = 3.0    # a response slower than this many times the fastest seen counts as congestion
+
+
+class AdaptiveLimiter:
+    """
+    Limits the number of requests in flight and adjusts the limit from each request's outcome
+    """
+    def __init__(self, max_limit, initial_limit=INITIAL_LIMIT, min_limit=MIN_LIMIT):
+        self.max_limit = max(max_limit, min_limit)
+        self.min_limit = min_limit
+        self.limit = float(min(max(initial_limit, min_limit), self.max_limit))
+        self.in_flight = 0
+        self.min_latency = None
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Waits for a free slot under the current limit
+
+        ARGUMENTS:
+            None
+
+        RETURNS:
+        started: float
+            time.monotonic() when the slot was taken, to be passed back to release
+        """
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+        return time.monotonic()
+
+    def release(self, started, ok):
+        """
+        Frees a slot and adjusts the limit from the request's outcome
+
+        ARGUMENTS:
+        started: float
+            Value returned from acquire
+        ok: bool
+            False if the request failed with a timeout, connection error, 429 or 5xx
+
+        RETURNS:
+            None
+        """
+        now = time.monotonic()
+        latency = now - started
+        with self.condition:
+            self.in_flight -= 1
+            if ok and (self.min_latency is None or latency < self.min_latency):
+                self.min_latency = latency
+            slow = self.min_latency is not None and latency > self.min_latency * LATENCY_FACTOR
+
+            if ok and not slow:
+                # additive increase: about +1 for every `limit` successful requests
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            elif now - self.last_decrease > latency:
+                # multiplicative decrease, at most once per round trip so a burst of failures only counts once
+                self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+                self.last_decrease = now
+            self.condition.notify_all()
+
+    def current_limit(self):
+        """
+        Gets the current whole-number concurrency limit
+
+        ARGUMENTS:
+            None
+
+        RETURNS:
+        limit: int
+            Number of requests currently allowed in flight
+        """
+        with self.condition:
+            return int(self.limit)
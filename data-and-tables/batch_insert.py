@@ -0,0 +1,44 @@
+import itertools
+
+# Batched writes for the insert_* functions in the fill_* scripts
+# Rows are written with executemany and committed once per batch instead of once per row, so a run pays for one
+# transaction (and one fsync) per batch. Batches never hold more rows than the limit still allows, and executemany's
+# rowcount is the total number of rows the batch wrote, so rows a statement skips are still not counted towards
+# the limit and the next batch picks up right after the last row that was tried, exactly like the per-row loop
+
+BATCH_SIZE = 100    # rows written per transaction
+
+
+def insert_in_batches(items, start, end, limit, write_batch, conn, batch_size=BATCH_SIZE):
+    """
+    Writes items[start:end] in batches until limit rows have been inserted or the items run out
+
+    ARGUMENTS:
+    items: list or generator
+        The records to write
+    start: int
+        Integer starting point which to iterate from (remembers where it left off)
+    end: int
+        Integer upper bound of where to iterate through (maximum number of items the API supplies)
+    limit: int
+        Integer limit of how many rows can be inserted
+    write_batch: function
+        write_batch(batch) writes a list of records with executemany and returns the cursor's rowcount
+    conn:
+        SQLite connection object
+    batch_size: int
+        Maximum number of records written per transaction
+
+    RETURNS:
+    count: int
+        Number of rows inserted
+    """
+    items = itertools.islice(items, start, end)
+    count = 0
+    while count < limit:
+        batch = list(itertools.islice(items, min(batch_size, limit - count)))
+        if not batch:
+            break
+        count += write_batch(batch)
+        conn.commit()
+    return count
@@ -0,0 +1,151 @@
+import time
+import threading
+import requests
+
+# Per-host circuit breakers used by http_client
+# After FAILURE_THRESHOLD failures in a row (connection errors, timeouts, 5xx), a host's circuit opens and every
+# request to it fails at once with CircuitOpenError instead of waiting on a dead host. After RESET_TIMEOUT seconds
+# the circuit goes half-open and lets HALF_OPEN_REQUESTS trial requests through: if they succeed it closes again,
+# if one fails it opens for another RESET_TIMEOUT
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+FAILURE_THRESHOLD = 5       # consecutive failures that open the circuit
+RESET_TIMEOUT = 30.0        # seconds the circuit stays open before a trial request is allowed
+HALF_OPEN_REQUESTS = 1      # trial requests allowed through at once while half-open
+FAILURE_STATUSES = {500, 502, 503, 504}     # response statuses counted as a failure of the host
+
+breakers = {}
+breakers_lock = threading.Lock()
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """
+    Raised instead of sending a request to a host whose circuit is open.
+    Subclasses requests.ConnectionError so callers that already skip failed requests skip these too
+    """
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker for one host
+    """
+    def __init__(self, host, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT,
+                 half_open_requests=HALF_OPEN_REQUESTS):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_requests = half_open_requests
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trials = 0
+        self.lock = threading.Lock()
+
+    def before_request(self):
+        """
+        Checks whether a request may be sent. Moves an open circuit to half-open once RESET_TIMEOUT has passed
+
+        ARGUMENTS:
+            None
+
+        RETURNS:
+            None. Raises CircuitOpenError if the request has to fail fast
+        """
+        with self.lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    raise CircuitOpenError(f"Circuit for {self.host} is open")
+                self.state = HALF_OPEN
+                self.trials = 0
+                print(f"Circuit for {self.host} is half-open, sending a trial request")
+            if self.state == HALF_OPEN:
+                if self.trials >= self.half_open_requests:
+                    raise CircuitOpenError(f"Circuit for {self.host} is half-open and waiting on a trial request")
+                self.trials += 1
+
+    def record_success(self):
+        """
+        Records a request that reached the host. Closes a half-open circuit
+
+        ARGUMENTS:
+            None
+
+        RETURNS:
+            None
+        """
+        with self.lock:
+            if self.state == HALF_OPEN:
+                print(f"Circuit for {self.host} closed")
+            self.state = CLOSED
+            self.failures = 0
+            self.trials = 0
+
+    def record_failure(self):
+        """
+        Records a failed request. Opens the circuit after failure_threshold failures in a row,
+        or straight away if a half-open trial failed
+
+        ARGUMENTS:
+            None
+
+        RETURNS:
+            None
+        """
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                if self.state == CLOSED:
+                    print(f"{self.failures} failures in a row from {self.host}, opening its circuit "
+                          f"for {self.reset_timeout:g}s")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def is_open(self):
+        """
+        Checks whether requests to the host are currently being refused
+
+        ARGUMENTS:
+            None
+
+        RETURNS:
+        open: bool
+            True while the circuit is open and RESET_TIMEOUT has not passed yet
+        """
+        with self.lock:
+            return self.state == OPEN and time.monotonic() - self.opened_at < self.reset_timeout
+
+
+def get_breaker(host):
+    """
+    Gets the circuit breaker for a host, creating it on first use
+
+    ARGUMENTS:
+    host: str
+        The host name, e.g. gsi.fly.dev
+
+    RETURNS:
+    breaker: CircuitBreaker
+        The breaker shared by every request to that host
+    """
+    with breakers_lock:
+        if host not in breakers:
+            breakers[host] = CircuitBreaker(host)
+        return breakers[host]
+
+
+def get_states():
+    """
+    Gets the state of every host's circuit
+
+    ARGUMENTS:
+        None
+
+    RETURNS:
+    states: dict
+        Dictionary where the keys are host names and the values are 'closed', 'open' or 'half-open'
+    """
+    with breakers_lock:
+        return {host: breaker.state for host, breaker in breakers.items()}
@@ -0,0 +1,86 @@
+import os
+import sqlite3
+from urllib.request import pathname2url
+
+# Connections to genshin_impact_data.db, shared by the fill_* scripts, calculations.py and graphs.py
+# Each caller picks a named profile of PRAGMA settings:
+#   'default'   sqlite3's own settings (rollback journal, synchronous=FULL, 2 MB page cache)
+#   'bulk'      for loading: WAL, synchronous=NORMAL (still safe with WAL, but no fsync per commit),
+#               a large page cache, memory-mapped reads and in-memory temp tables
+#   'readonly'  for analysis: the file is opened through a mode=ro URI, so nothing can write to it,
+#               with the same read-side cache settings as 'bulk'
+
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "genshin_impact_data.db")
+
+DEFAULT = 'default'
+BULK = 'bulk'
+READONLY = 'readonly'
+
+CACHE_SIZE = -64 * 1024             # page cache size, negative means KB (64 MB)
+MMAP_SIZE = 256 * 1024 * 1024       # bytes of the database file read through mmap
+PROFILES = {
+    DEFAULT: {},
+    BULK: {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': CACHE_SIZE,
+        'mmap_size': MMAP_SIZE,
+        'temp_store': 'MEMORY',
+    },
+    READONLY: {
+        'cache_size': CACHE_SIZE,
+        'mmap_size': MMAP_SIZE,
+        'temp_store': 'MEMORY',
+    },
+}
+
+
+def set_up_database(db_name=DB_PATH, profile=DEFAULT):
+    """
+    Sets up a SQLite database connection and cursor
+
+    ARGUMENTS:
+    db_name: str
+        The name of the SQLite database
+    profile: str
+        Name of the settings profile to apply, one of PROFILES
+
+    RETURNS:
+    Tuple (Cursor, Connection):
+        A tuple containing the database cursor and connection objects
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown database profile {profile!r}, expected one of {', '.join(PROFILES)}")
+
+    if profile == READONLY:
+        # mode=ro also stops sqlite3 from creating an empty database when the file is missing
+        conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(db_name))}?mode=ro", uri=True)
+    else:
+        conn = sqlite3.connect(db_name)
+    cur = conn.cursor()
+    for pragma, value in PROFILES[profile].items():
+        cur.execute(f"PRAGMA {pragma} = {value}")
+    return cur, conn
+
+
+def close_database(cur, conn, tables=()):
+    """
+    Refreshes the planner statistics of the tables a run wrote to and closes the connection.
+    Meant to be called once at the end of a fill script, after its inserts are committed,
+    so sqlite_stat1 describes the rows that are actually in the tables
+
+    ARGUMENTS:
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+    tables: list
+        The tables to ANALYZE, e.g. ['Weapons']
+
+    RETURNS:
+        None
+    """
+    for table in tables:
+        cur.execute(f"ANALYZE {table}")
+    conn.commit()
+    conn.close()
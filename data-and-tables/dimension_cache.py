@@ -0,0 +1,68 @@
+# Name -> id lookups for the small dimension tables (WeaponTypes, CharacterVisions, Characters)
+# The fill_* scripts used to resolve every foreign key with a (SELECT id FROM ... WHERE name = ?) subselect per row.
+# A DimensionCache reads the whole table once, resolves keys in Python and adds missing values as they show up,
+# so the fact inserts are plain parameterized INSERTs. A cache is meant to live for one insert or update call:
+# it does not see rows other connections add after it was loaded
+
+
+class DimensionCache:
+    """
+    Value -> id map for one column of a dimension table, loaded on first use
+    """
+    def __init__(self, table, column, cur):
+        self.table = table
+        self.column = column
+        self.cur = cur
+        self.ids = None
+
+    def load(self):
+        """
+        Reads every value and its id from the table. If a value is in the table more than once,
+        the lowest id is kept, the row a subselect on the column would find
+
+        ARGUMENTS:
+            None
+
+        RETURNS:
+            None
+        """
+        self.ids = {}
+        self.cur.execute(f"SELECT id, {self.column} FROM {self.table} ORDER BY id")
+        for row_id, value in self.cur.fetchall():
+            self.ids.setdefault(value, row_id)
+
+    def get_id(self, value):
+        """
+        Looks up the id of a value
+
+        ARGUMENTS:
+        value: str
+            The value to look up, e.g. a weapon type or a character name
+
+        RETURNS:
+        row_id: int or None
+            The value's id, or None (NULL) if it is not in the table
+        """
+        if self.ids is None:
+            self.load()
+        return self.ids.get(value)
+
+    def get_or_insert_id(self, value):
+        """
+        Looks up the id of a value, inserting the value into the table the first time it shows up.
+        Not committed, the caller commits together with the rows that reference it
+
+        ARGUMENTS:
+        value: str
+            The value to look up, e.g. a weapon type
+
+        RETURNS:
+        row_id: int
+            The value's id
+        """
+        row_id = self.get_id(value)
+        if row_id is None:
+            self.cur.execute(f"INSERT INTO {self.table} ({self.column}) VALUES (?)", (value, ))
+            row_id = self.cur.lastrowid
+            self.ids[value] = row_id
+        return row_id
@@ -1,52 +1,225 @@
-import sqlite3
-import requests
-from bs4 import BeautifulSoup
+import sys
+import database
+import http_client
+import batch_insert
+import natural_keys
+import sync_state
+import scrape_state
+from bs4 import BeautifulSoup, FeatureNotFound, SoupStrainer
+from html.parser import HTMLParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import re
+import multiprocessing
+
+HTML_PARSERS = ['lxml', 'html.parser']     # BeautifulSoup backends to try, fastest first. lxml is optional
+# How much of the Artifacts/Sets page gets parsed:
+#   'page'   - build the whole page with BeautifulSoup, then find the artifact table in it
+#   'table'  - BeautifulSoup with a SoupStrainer, so only wikitable elements are built
+#   'stream' - skip straight to the first wikitable and walk it with an event-based parser, keeping one row at a time
+SCOPES = ['page', 'table', 'stream']
+SCOPE = 'stream'
+WIKITABLE_PATTERN = re.compile(r"<table\b[^>]*\bclass=\"[^\"]*\bwikitable\b")
+STREAM_CHUNK_SIZE = 64 * 1024     # characters fed to the event-based parser at a time
+SET_QUALITY_PATTERN = r"\d"
+BONUSES_PATTERN = r"(\d+)\sPiece:\s(.*?)(?=(\d+\sPiece:|$))"     # '2 Piece: ...4 Piece: ...' -> (2, ...), (4, ...)
+WIKI_BASE_URL = "https://genshin-impact.fandom.com"
+DEEP_FETCH_WORKERS = 8      # piece pages downloaded at once by the deep scrape (the wiki's rate limit still applies)
+DEEP_PARSE_PROCESSES = None     # processes parsing piece pages. None means one per CPU core
+ANALYZED_TABLES = ['Artifacts', 'ArtifactSets', 'ArtifactPieces']     # tables ANALYZEd at the end of a run
 
-# Database Setup
-def set_up_database(db_name):
-    """
-    Sets up a SQLite database connection and cursor
 
+##########################--ARTIFACTS--#################################
+#Scrape and insert the artifact data into the table
+def get_artifact_data(url, parser=None, scope=SCOPE):
+    """
+    Scrapes artifact data from the Genshin Impact Wiki Artifacts/Sets page and inserts it into the Artifacts table
+    
     ARGUMENTS:
-    db_name: str
-        The name of the SQLite database
+    url: str
+        The URL of the Genshin Impact Wiki Artifacts/Sets page
+    parser: str
+        BeautifulSoup parser backend ('lxml' or 'html.parser'). If None, the fastest installed one is used
+    scope: str
+        How much of the page to parse, one of SCOPES
 
     RETURNS:
-    Tuple (Cursor, Connection):
-        A tuple containing the database cursor and connection objects
+    all_media_data: list
+        List of data for each artifact on the Genshin Impact Wiki Artifacts/Sets page
+    """
+    return list(iter_artifact_data(url, parser, scope))
+
+def iter_artifact_data(url, parser=None, scope=SCOPE):
+    """
+    Generator version of get_artifact_data. Yields each artifact piece while walking the artifact table
+
+    ARGUMENTS:
+    url: str
+        The URL of the Genshin Impact Wiki Artifacts/Sets page
+    parser: str
+        BeautifulSoup parser backend. If None, the fastest installed one is used
+    scope: str
+        How much of the page to parse, one of SCOPES
+
+    YIELDS:
+    artifact: dict
+        Dictionary with the artifact piece's name and its set's max quality
+    """
+    print(f"Artifact data being gathered from https://genshin-impact.fandom.com/wiki/Artifact/Sets! Please wait...")
+    # Scrape the site
+    r = http_client.get(url)
+    yield from parse_artifact_page(r.text, parser, scope)
+    print(f"Artifact web scraping done! Adding items to the database...")
+
+def get_artifact_snapshot(url, cur, conn, parser=None, scope=SCOPE, revalidate=False):
     """
-    conn = sqlite3.connect(db_name)
-    cur = conn.cursor()
-    return cur, conn
+    Gets every artifact set on the page, only parsing the page if it changed since the last run
+
+    ARGUMENTS:
+    url: str
+        The URL of the Genshin Impact Wiki Artifacts/Sets page
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+    parser: str
+        BeautifulSoup parser backend. If None, the fastest installed one is used
+    scope: str
+        How much of the page to parse, one of SCOPES
+    revalidate: bool
+        If True, a cached copy of the page is checked with the server again (see http_client.get)
 
+    RETURNS:
+    Tuple (list, str, bool):
+        The artifact sets (see parse_artifact_sets), the page's fingerprint, and whether everything
+        on this exact page is already stored
+    """
+    print(f"Artifact data being gathered from https://genshin-impact.fandom.com/wiki/Artifact/Sets! Please wait...")
+    r = http_client.get(url, revalidate=revalidate)
+    fingerprint = scrape_state.page_fingerprint(r.text)
+    page = scrape_state.get_scraped_page(url, cur, conn)
 
+    if page is not None and page['fingerprint'] == fingerprint:
+        print(f"Artifact page unchanged ({fingerprint}), reusing the {len(page['rows'])} artifact sets parsed last time")
+        artifact_sets = page['rows']
+    else:
+        artifact_sets = list(parse_artifact_sets(r.text, parser, scope))
+        scrape_state.save_scraped_page(url, fingerprint, artifact_sets, cur, conn)
+        print(f"Artifact web scraping done! Adding items to the database...")
+
+    num_pieces = sum(len(artifact_set['pieces']) for artifact_set in artifact_sets)
+    cur.execute("SELECT (SELECT count(*) FROM Artifacts), (SELECT count(*) FROM ArtifactSets)")
+    stored_pieces, stored_sets = cur.fetchone()
+    stored = (page is not None and page['stored_fingerprint'] == fingerprint
+              and stored_pieces >= num_pieces and stored_sets >= len(artifact_sets))
+    return artifact_sets, fingerprint, stored
+
+def get_html_parser(parser=None):
+    """
+    Picks the BeautifulSoup parser backend
 
+    ARGUMENTS:
+    parser: str
+        The backend asked for, or None to use the first installed backend in HTML_PARSERS
 
+    RETURNS:
+    parser: str
+        Name of the backend to pass to BeautifulSoup
+    """
+    if parser is not None:
+        return parser
+    for candidate in HTML_PARSERS:
+        try:
+            BeautifulSoup("", candidate)
+        except FeatureNotFound:
+            continue
+        return candidate
+    return 'html.parser'
 
+def parse_artifact_page(html, parser=None, scope=SCOPE):
+    """
+    Generator that walks the artifact table of an Artifacts/Sets page. Every parser backend and scope
+    yields the same pieces
 
+    ARGUMENTS:
+    html: str
+        The page's HTML
+    parser: str
+        BeautifulSoup parser backend for the 'page' and 'table' scopes. If None, the fastest installed one is used
+    scope: str
+        How much of the page to parse, one of SCOPES
+
+    YIELDS:
+    artifact: dict
+        Dictionary with the artifact piece's name and its set's max quality
+    """
+    yield from artifact_pieces(parse_artifact_sets(html, parser, scope))
 
+def artifact_pieces(artifact_sets):
+    """
+    Generator that flattens artifact sets into the piece rows of the Artifacts table
 
+    ARGUMENTS:
+    artifact_sets: list or generator
+        Artifact sets, returned from parse_artifact_sets
 
+    YIELDS:
+    artifact: dict
+        Dictionary with the artifact piece's name and its set's max quality
+    """
+    for artifact_set in artifact_sets:
+        for piece in artifact_set['pieces']:
+            yield {'name':piece['name'], 'max_set_quality':artifact_set['max_quality']}
 
-##########################--ARTIFACTS--#################################
-#Scrape and insert the artifact data into the table
-def get_artifact_data(url):
+def sets_for_pieces(artifact_sets, names):
     """
-    Scrapes artifact data from the Genshin Impact Wiki Artifacts/Sets page and inserts it into the Artifacts table
-    
+    Narrows artifact sets down to the given pieces, so the set tables are written in the same stages as the Artifacts table
+
     ARGUMENTS:
-    url: str
-        The URL of the Genshin Impact Wiki Artifacts/Sets page
+    artifact_sets: list
+        Artifact sets, returned from parse_artifact_sets or get_artifact_snapshot
+    names: list
+        Names of the artifact pieces to keep
 
     RETURNS:
-    all_media_data: list
-        List of data for each artifact on the Genshin Impact Wiki Artifacts/Sets page
+    artifact_sets: list
+        The sets that own at least one of the pieces, each with only those pieces
     """
-    print(f"Artifact data being gathered from https://genshin-impact.fandom.com/wiki/Artifact/Sets! Please wait...")
-    # Scrape the site
-    r = requests.get(url)
-    soup = BeautifulSoup(r.text, 'html.parser')
+    names = set(names)
+    narrowed = []
+    for artifact_set in artifact_sets:
+        pieces = [piece for piece in artifact_set['pieces'] if piece['name'] in names]
+        if pieces:
+            narrowed.append({**artifact_set, 'pieces':pieces})
+    return narrowed
+
+def parse_artifact_sets(html, parser=None, scope=SCOPE):
+    """
+    Generator that walks the artifact table of an Artifacts/Sets page once, yielding everything in each row.
+    Every parser backend and scope yields the same sets
+
+    ARGUMENTS:
+    html: str
+        The page's HTML
+    parser: str
+        BeautifulSoup parser backend for the 'page' and 'table' scopes. If None, the fastest installed one is used
+    scope: str
+        How much of the page to parse, one of SCOPES
+
+    YIELDS:
+    artifact_set: dict
+        One set per table row, returned from make_artifact_set
+    """
+    if scope == 'stream':
+        yield from stream_artifact_table(html)
+        return
+    if scope == 'table':
+        # the class is matched against the raw attribute ("wikitable sortable ...") while parsing, hence the regex
+        strainer = SoupStrainer("table", class_=re.compile(r"\bwikitable\b"))
+        soup = BeautifulSoup(html, get_html_parser(parser), parse_only=strainer)
+    elif scope == 'page':
+        soup = BeautifulSoup(html, get_html_parser(parser))
+    else:
+        raise ValueError(f"Unknown parse scope: {scope}")
     
     # Find artifact table
     artifact_table = soup.find("table", class_="wikitable")
@@ -54,32 +227,157 @@ def get_artifact_data(url):
         raise ValueError("Could not find the artifact table.")
     
     rows = artifact_table.find_all("tr")
-    set_quality_pattern = r"\d"
 
-    all_artifact_data = []
     for row in rows:
         columns = row.find_all("td")
         if len(columns) < 4:  # Ensure the row has the expected number of columns
             continue
 
-        # Extract artifact set details
-        set_quality = columns[1].text.strip()
-        set_quality_matches = re.findall(set_quality_pattern, set_quality)
-        max_set_quality = max(map(int, set_quality_matches))
-        pieces_column = columns[2]
-        pieces = pieces_column.find_all("span", class_="item")
+        # Columns: name, quality, pieces, bonuses
+        pieces = columns[2].find_all("span", class_="item")
+        links = [piece.find("a") for piece in pieces]
+        piece_links = [(link.get("title"), link.get("href")) for link in links if link]
 
-        for piece in pieces:
-            link = piece.find("a")
-            if not link:
-                continue
+        yield make_artifact_set(columns[0].text, columns[1].text, columns[3].text, piece_links, len(pieces))
 
-            # Extract individual artifact details
-            artifact_name = link.get("title")
+def make_artifact_set(name_text, quality_text, bonuses_text, piece_links, num_pieces):
+    """
+    Builds an artifact set from the text and links of one artifact table row
 
-            all_artifact_data.append({'name':artifact_name, 'max_set_quality':max_set_quality})
-    print(f"Artifact web scraping done! Adding items to the database...")
-    return all_artifact_data
+    ARGUMENTS:
+    name_text: str
+        Text of the name column
+    quality_text: str
+        Text of the quality column, e.g. '3-4★'
+    bonuses_text: str
+        Text of the bonuses column, e.g. '2 Piece: DEF +30%4 Piece: ...'
+    piece_links: list
+        (title, href) of the first link in every span.item of the pieces column
+    num_pieces: int
+        Number of span.item in the pieces column
+
+    RETURNS:
+    artifact_set: dict
+        Dictionary with the set's name, min_quality, max_quality, num_pieces, pieces ({'name', 'url'} each)
+        and bonuses ({'pieces', 'bonus'} each)
+    """
+    qualities = [int(match) for match in re.findall(SET_QUALITY_PATTERN, quality_text)]
+    return {
+        'name': name_text.strip(),
+        'min_quality': min(qualities),
+        'max_quality': max(qualities),
+        'num_pieces': num_pieces,
+        'pieces': [
+            {'name': title, 'url': f"{WIKI_BASE_URL}{href}" if href else None}
+            for title, href in piece_links
+        ],
+        'bonuses': [
+            {'pieces': int(match[0]), 'bonus': match[1].strip()}
+            for match in re.findall(BONUSES_PATTERN, bonuses_text)
+        ],
+    }
+
+def stream_artifact_table(html):
+    """
+    Generator that walks only the first wikitable of an Artifacts/Sets page with an event-based parser.
+    Everything before the table is skipped without being parsed, and parsing stops when the table ends
+
+    ARGUMENTS:
+    html: str
+        The page's HTML
+
+    YIELDS:
+    artifact_set: dict
+        One set per table row, returned from make_artifact_set
+    """
+    match = WIKITABLE_PATTERN.search(html)
+    if not match:
+        raise ValueError("Could not find the artifact table.")
+
+    table_parser = ArtifactTableParser()
+    for start in range(match.start(), len(html), STREAM_CHUNK_SIZE):
+        table_parser.feed(html[start:start + STREAM_CHUNK_SIZE])
+        yield from table_parser.artifact_sets
+        table_parser.artifact_sets.clear()
+        if table_parser.done:
+            break
+
+class ArtifactTableParser(HTMLParser):
+    """
+    Event-based parser for the artifact table. Reads the same cells parse_artifact_sets does: the text of the
+    name, quality and bonuses columns, and the first link in every span.item of the pieces column
+    """
+    def __init__(self):
+        super().__init__()
+        self.artifact_sets = []     # sets from finished rows that have not been yielded yet
+        self.done = False
+        self.table_depth = 0
+        self.row = None
+        self.column = -1
+        self.open_spans = []        # for every open span in the pieces column: True while it is a span.item with no link yet
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if tag == "table":
+            self.table_depth += 1
+        elif tag == "tr" and self.table_depth == 1:
+            self.end_row()
+            self.row = {'columns': 0, 'text': {0: [], 1: [], 3: []}, 'piece_links': [], 'num_pieces': 0}
+            self.column = -1
+        elif tag == "td" and self.row is not None:
+            self.row['columns'] += 1
+            self.column = self.row['columns'] - 1
+            self.open_spans = []
+        elif self.column == 2 and tag == "span":
+            is_item = "item" in (dict(attrs).get("class") or "").split()
+            self.row['num_pieces'] += is_item
+            self.open_spans.append(is_item)
+        elif self.column == 2 and tag == "a" and any(self.open_spans):
+            # the first link inside each waiting span.item is the piece
+            link = dict(attrs)
+            for _ in range(self.open_spans.count(True)):
+                self.row['piece_links'].append((link.get("title"), link.get("href")))
+            self.open_spans = [False] * len(self.open_spans)
+
+    def handle_endtag(self, tag):
+        if self.done:
+            return
+        if tag == "span" and self.column == 2 and self.open_spans:
+            self.open_spans.pop()
+        elif tag == "td":
+            self.column = -1
+        elif tag == "tr" and self.table_depth == 1:
+            self.end_row()
+        elif tag == "table":
+            self.table_depth -= 1
+            if self.table_depth == 0:
+                self.end_row()
+                self.done = True
+
+    def handle_data(self, data):
+        if self.row is not None and self.column in self.row['text'] and not self.done:
+            self.row['text'][self.column].append(data)
+
+    def end_row(self):
+        """
+        Turns the row being read into an artifact set, skipping rows with fewer than 4 columns
+
+        ARGUMENTS:
+            None
+
+        RETURNS:
+            None
+        """
+        row = self.row
+        self.row = None
+        self.column = -1
+        if row is None or row['columns'] < 4:
+            return
+        text = {column: "".join(parts) for column, parts in row['text'].items()}
+        self.artifact_sets.append(
+            make_artifact_set(text[0], text[1], text[3], row['piece_links'], row['num_pieces'])
+        )
 
 # Setup the Artifacts table
 def setup_artifacts_table(cur, conn):
@@ -105,13 +403,103 @@ def setup_artifacts_table(cur, conn):
         """
     )
     conn.commit()
+    natural_keys.add_natural_key('Artifacts', ['name'], cur, conn)
+
+# Setup the normalized artifact set tables
+def setup_artifact_set_tables(cur, conn):
+    """
+    Sets up the ArtifactSets, ArtifactPieces and ArtifactSetBonuses tables and their indexes
+
+    ARGUMENTS:
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+
+    RETURNS:
+        None
+    """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ArtifactSets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            min_quality INTEGER NOT NULL,
+            max_quality INTEGER NOT NULL,
+            num_pieces INTEGER NOT NULL
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ArtifactPieces (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            url TEXT,
+            set_id INTEGER NOT NULL,
+            FOREIGN KEY (set_id) REFERENCES ArtifactSets(id)
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ArtifactSetBonuses (
+            set_id INTEGER NOT NULL,
+            pieces INTEGER NOT NULL,
+            bonus TEXT NOT NULL,
+            PRIMARY KEY (set_id, pieces),
+            FOREIGN KEY (set_id) REFERENCES ArtifactSets(id)
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_artifact_sets_quality ON ArtifactSets (max_quality, min_quality)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_artifact_pieces_set ON ArtifactPieces (set_id)")
+    conn.commit()
+
+def insert_artifact_sets(artifact_sets, cur, conn):
+    """
+    Writes artifact sets into the ArtifactSets, ArtifactPieces and ArtifactSetBonuses tables.
+    Sets and pieces already in the tables (matched by name) are updated in place, and a set's bonuses are replaced
+
+    ARGUMENTS:
+    artifact_sets: list
+        Artifact sets, returned from parse_artifact_sets or get_artifact_snapshot
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+
+    RETURNS:
+        None
+    """
+    # UPDATE first and INSERT only if nothing matched: an upsert would burn an AUTOINCREMENT id on every existing row
+    for artifact_set in artifact_sets:
+        set_values = (artifact_set['min_quality'], artifact_set['max_quality'], artifact_set['num_pieces'], artifact_set['name'])
+        cur.execute("UPDATE ArtifactSets SET min_quality = ?, max_quality = ?, num_pieces = ? WHERE name = ?", set_values)
+        if cur.rowcount == 0:
+            cur.execute("INSERT INTO ArtifactSets (min_quality, max_quality, num_pieces, name) VALUES (?, ?, ?, ?)", set_values)
+        cur.execute("SELECT id FROM ArtifactSets WHERE name = ?", (artifact_set['name'], ))
+        set_id = cur.fetchone()[0]
+
+        for piece in artifact_set['pieces']:
+            piece_values = (piece['url'], set_id, piece['name'])
+            cur.execute("UPDATE ArtifactPieces SET url = ?, set_id = ? WHERE name = ?", piece_values)
+            if cur.rowcount == 0:
+                cur.execute("INSERT INTO ArtifactPieces (url, set_id, name) VALUES (?, ?, ?)", piece_values)
+
+        cur.execute("DELETE FROM ArtifactSetBonuses WHERE set_id = ?", (set_id, ))
+        cur.executemany(
+            "INSERT OR REPLACE INTO ArtifactSetBonuses (set_id, pieces, bonus) VALUES (?, ?, ?)",
+            [(set_id, bonus['pieces'], bonus['bonus']) for bonus in artifact_set['bonuses']]
+        )
+    conn.commit()
 
-def insert_artifact_data(artifact_data, start, end, limit, cur, conn):
+def insert_artifact_data(artifact_data, start, end, limit, cur, conn, batch_size=batch_insert.BATCH_SIZE):
     """
     Inserts the media data for each character into the Media table.
 
     ARGUMENTS:
-    artifact_data: list
+    artifact_data: list or generator
         List of data for all artifacts, returned from get_artifact_data
     start: int
         Integer starting point which to iterate from (remembers where it left off)
@@ -123,30 +511,295 @@ def insert_artifact_data(artifact_data, start, end, limit, cur, conn):
         SQLite cursor object
     conn:
         SQLite connection object
+    batch_size: int
+        Maximum number of artifacts written per transaction
     
     RETURNS:
         None
     """
-    count = 0
-    for i in range(start, end):
-        cur.execute("""
-            INSERT OR IGNORE INTO Artifacts 
+    def write_batch(artifacts):
+        cur.executemany("""
+            INSERT INTO Artifacts 
             (name, max_set_quality)
             VALUES (
                     ?,
                     ?
             )
+            ON CONFLICT (name) DO UPDATE SET max_set_quality = excluded.max_set_quality
             """, 
-            (
-                artifact_data[i]['name'],
-                artifact_data[i]['max_set_quality']
-            )
+            [
+                (
+                    artifact['name'],
+                    artifact['max_set_quality']
+                )
+                for artifact in artifacts
+            ]
         )
-        conn.commit()
-        if cur.rowcount != 0:
-            count += 1
-        if count == limit:
-            break
+        return cur.rowcount
+
+    batch_insert.insert_in_batches(artifact_data, start, end, limit, write_batch, conn, batch_size)
+
+
+
+
+
+
+
+
+
+
+# Update existing rows in the Artifacts table
+def update_artifact_data(artifact_rows, cur, conn):
+    """
+    Updates artifacts that are already in the Artifacts table with freshly scraped data
+
+    ARGUMENTS:
+    artifact_rows: list
+        List of (row id, artifact data) tuples
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+
+    RETURNS:
+        None
+    """
+    for row_id, artifact in artifact_rows:
+        cur.execute(
+            "UPDATE Artifacts SET name = ?, max_set_quality = ? WHERE id = ?",
+            (artifact['name'], artifact['max_set_quality'], row_id)
+        )
+    conn.commit()
+
+# Get the rows in the Artifacts table
+def get_stored_artifact_rows(cur):
+    """
+    Gets every row in the Artifacts table by its natural key, so delta sync can match upstream records to them
+
+    ARGUMENTS:
+    cur:
+        SQLite cursor object
+
+    RETURNS:
+    rows: dict
+        Dictionary where the keys are artifact names and the values are row ids
+    """
+    cur.execute("SELECT name, id FROM Artifacts")
+    return dict(cur.fetchall())
+
+# Delta sync
+def delta_sync_artifacts(artifact_url, limit, refresh_window, cur, conn):
+    """
+    Inserts only the artifacts that are not in the database yet, and refreshes the most recently added ones.
+    The wiki page is a single request, so this saves the inserts rather than the download.
+    The normalized artifact set tables are only written for the artifacts that are inserted or refreshed.
+    Does nothing if the page has not changed since all of its artifacts were stored
+
+    ARGUMENTS:
+    artifact_url: str
+        The URL of the Genshin Impact Wiki Artifacts/Sets page
+    limit: int
+        Maximum number of new artifacts to insert
+    refresh_window: int
+        Number of most recently synced artifacts to update
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+
+    RETURNS:
+    Tuple (int, int):
+        Number of artifacts inserted and number of artifacts refreshed
+    """
+    # the page is the source of every refreshed artifact, so it is checked with the wiki even if it is cached
+    artifact_sets, fingerprint, stored = get_artifact_snapshot(artifact_url, cur, conn, revalidate=True)
+    if stored:
+        return 0, 0
+
+    artifacts_by_name = {artifact['name']: artifact for artifact in artifact_pieces(artifact_sets)}
+    def insert(artifacts):
+        insert_artifact_sets(sets_for_pieces(artifact_sets, [artifact['name'] for artifact in artifacts]), cur, conn)
+        insert_artifact_data(artifacts, 0, len(artifacts), limit, cur, conn)
+    def update(rows):
+        insert_artifact_sets(sets_for_pieces(artifact_sets, [artifact['name'] for row_id, artifact in rows]), cur, conn)
+        update_artifact_data(rows, cur, conn)
+    inserted, refreshed = sync_state.delta_sync(
+        resource='artifacts',
+        all_keys=list(artifacts_by_name),
+        fetch=lambda names, revalidate=False: [artifacts_by_name[name] for name in names],
+        insert=insert,
+        update=update,
+        stored_rows=lambda: get_stored_artifact_rows(cur),
+        cur=cur,
+        conn=conn,
+        limit=limit,
+        refresh_window=refresh_window
+    )
+    synced = sync_state.get_synced_keys('artifacts', list(artifacts_by_name), get_stored_artifact_rows(cur), cur, conn)
+    if all(name in synced for name in artifacts_by_name):
+        scrape_state.mark_page_stored(artifact_url, fingerprint, cur, conn)
+    return inserted, refreshed
+
+
+
+
+
+
+
+
+
+
+##########################--ARTIFACT PIECE PAGES--#################################
+# Optional deep scrape (python data-and-tables/fill_artifact_table.py --deep): every piece in ArtifactPieces links to
+# its own wiki page. The pages are downloaded by a thread pool and parsed by a process pool, and each page is
+# checkpointed in ScrapedPages as soon as its details are stored, so an interrupted run picks up where it stopped
+def parse_artifact_piece_page(html):
+    """
+    Reads the infobox of an artifact piece's wiki page. Runs in a worker process
+
+    ARGUMENTS:
+    html: str
+        The piece page's HTML
+
+    RETURNS:
+    details: dict
+        Dictionary where the keys are the infobox fields (its data-source names, e.g. 'title', 'set')
+        and the values are their text. Empty if the page has no infobox
+    """
+    soup = BeautifulSoup(html, get_html_parser(), parse_only=SoupStrainer("aside"))
+    infobox = soup.find("aside", class_="portable-infobox")
+    if not infobox:
+        return {}
+
+    details = {}
+    for item in infobox.find_all(attrs={"data-source": True}):
+        field = item.get("data-source")
+        value = item.find(class_="pi-data-value") or item
+        text = value.get_text(" ", strip=True)
+        if text and field not in details:
+            details[field] = text
+    return details
+
+def setup_artifact_piece_details_table(cur, conn):
+    """
+    Sets up the ArtifactPieceDetails table
+
+    ARGUMENTS:
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+
+    RETURNS:
+        None
+    """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ArtifactPieceDetails (
+            piece_id INTEGER NOT NULL,
+            field TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (piece_id, field),
+            FOREIGN KEY (piece_id) REFERENCES ArtifactPieces(id)
+        )
+        """
+    )
+    conn.commit()
+
+def insert_artifact_piece_details(piece_id, url, fingerprint, details, cur, conn):
+    """
+    Replaces a piece's details and checkpoints its page
+
+    ARGUMENTS:
+    piece_id: int
+        ID of the piece in ArtifactPieces
+    url: str
+        The piece page's URL
+    fingerprint: str
+        Fingerprint of the page, returned from scrape_state.page_fingerprint
+    details: dict
+        Infobox fields, returned from parse_artifact_piece_page
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+
+    RETURNS:
+        None
+    """
+    cur.execute("DELETE FROM ArtifactPieceDetails WHERE piece_id = ?", (piece_id, ))
+    cur.executemany(
+        "INSERT INTO ArtifactPieceDetails (piece_id, field, value) VALUES (?, ?, ?)",
+        [(piece_id, field, value) for field, value in details.items()]
+    )
+    conn.commit()
+    scrape_state.save_scraped_page(url, fingerprint, details, cur, conn)
+    scrape_state.mark_page_stored(url, fingerprint, cur, conn)
+
+def deep_scrape_artifact_pieces(cur, conn, fetch_workers=DEEP_FETCH_WORKERS, parse_processes=DEEP_PARSE_PROCESSES,
+                                refresh=False):
+    """
+    Downloads every artifact piece page concurrently, parses them in a process pool and stores their details.
+    Pages checkpointed by an earlier run are skipped unless refresh is True
+
+    ARGUMENTS:
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+    fetch_workers: int
+        Number of pages downloaded at once
+    parse_processes: int
+        Number of parser processes. If None, one per CPU core
+    refresh: bool
+        Whether to scrape pages that were already stored
+
+    RETURNS:
+    Tuple (int, int):
+        Number of pages stored and number of pages that failed
+    """
+    cur.execute("SELECT id, url FROM ArtifactPieces WHERE url IS NOT NULL ORDER BY id")
+    pieces = cur.fetchall()
+    if not pieces:
+        print("No artifact pieces in the database yet. Run fill_artifact_table.py without --deep first!")
+        return 0, 0
+    done_urls = set() if refresh else scrape_state.get_stored_urls(cur, conn)
+    pieces = [(piece_id, url) for piece_id, url in pieces if url not in done_urls]
+    print(f"Deep scrape: {len(pieces)} artifact piece pages to fetch ({len(done_urls)} already checkpointed)...")
+
+    stored = 0
+    failed = 0
+    responses = http_client.iter_all([url for _, url in pieces], max_workers=fetch_workers, adaptive=True)
+    # parser processes are started while the fetch threads are running, and forking a process with running threads
+    # can leave it holding locks nobody will release, so they are spawned instead
+    with ProcessPoolExecutor(max_workers=parse_processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending = {}
+
+        def store_finished(futures):
+            nonlocal stored, failed
+            for future in futures:
+                piece_id, url, fingerprint = pending.pop(future)
+                try:
+                    details = future.result()
+                except Exception as e:
+                    # one bad page should not throw away the rest of the scrape
+                    print(f"Failed to parse {url}: {e.__class__.__name__}: {e}")
+                    failed += 1
+                    continue
+                insert_artifact_piece_details(piece_id, url, fingerprint, details, cur, conn)
+                stored += 1
+
+        # pages are handed to the pool as they arrive, and stored as soon as they are parsed
+        for (piece_id, url), response in zip(pieces, responses):
+            if response is None or response.status_code != 200:
+                print(f"Failed to fetch {url}" + (f", Status: {response.status_code}" if response is not None else ""))
+                failed += 1
+                continue
+            future = pool.submit(parse_artifact_piece_page, response.text)
+            pending[future] = (piece_id, url, scrape_state.page_fingerprint(response.text))
+            store_finished([future for future in pending if future.done()])
+        store_finished(list(as_completed(pending)))
+    return stored, failed
 
 
 
@@ -158,18 +811,22 @@ def insert_artifact_data(artifact_data, start, end, limit, cur, conn):
 
 
 ##########################--MAIN--#################################
-def main():
+def main(delta=False, refresh_window=5, deep=False):
     '''
     Sets up database 
     Sets up artifact table
     Calls functions
     Inserts information into database
+
+    With delta=True, only artifacts missing from the database (plus the last refresh_window ones) are written
+    With deep=True, the wiki page of every artifact piece is scraped for piece details instead
     '''
     # Database setup
-    cur, conn = set_up_database("data-and-tables/genshin_impact_data.db")
+    cur, conn = database.set_up_database("data-and-tables/genshin_impact_data.db", profile=database.BULK)
     
     # Set up tables
     setup_artifacts_table(cur, conn)
+    setup_artifact_set_tables(cur, conn)
 
     # BS4 base URL
     artifact_url = "https://genshin-impact.fandom.com/wiki/Artifact/Sets"
@@ -178,7 +835,28 @@ def main():
 
 
     ##### Weapons #####
-    artifact_data = get_artifact_data(artifact_url)
+    if deep:
+        setup_artifact_piece_details_table(cur, conn)
+        stored, failed = deep_scrape_artifact_pieces(cur, conn)
+        print(f"Deep scrape done: {stored} artifact piece pages stored, {failed} failed.\n")
+        database.close_database(cur, conn, ANALYZED_TABLES)
+        return
+
+    if delta:
+        inserted, refreshed = delta_sync_artifacts(artifact_url, 25, refresh_window, cur, conn)
+        print(f"Delta sync done: {inserted} artifacts added, {refreshed} refreshed.\n")
+        database.close_database(cur, conn, ANALYZED_TABLES)
+        return
+
+    # the page is only parsed (and the table only written) when it changed since the last run
+    artifact_sets, fingerprint, stored = get_artifact_snapshot(artifact_url, cur, conn)
+    if stored:
+        print(f"All artifact data is already in the database and the wiki page has not changed. Please move on to fill_media_table.py!\n\n\n")
+        database.close_database(cur, conn, ANALYZED_TABLES)
+        return
+
+    # sets, pieces and bonuses all come from the same pass over the table
+    artifact_data = list(artifact_pieces(artifact_sets))
 
     # get info and insert into 
     cur.execute("SELECT max(id) FROM Artifacts")
@@ -189,18 +867,24 @@ def main():
     else:
         start = row[0]
         end = 251
+    limit = 251 if start >= 100 else 25
+    # the set tables are staged with the Artifacts table: this run writes the pieces it inserts, with their sets and bonuses
+    staged = [artifact['name'] for artifact in artifact_data[start:min(end, start + limit)]]
+    insert_artifact_sets(sets_for_pieces(artifact_sets, staged), cur, conn)
     if start >= 100:
-        insert_artifact_data(artifact_data=artifact_data, start=start, end=end, limit=251, cur=cur, conn=conn)
+        insert_artifact_data(artifact_data=artifact_data, start=start, end=end, limit=limit, cur=cur, conn=conn)
+        scrape_state.mark_page_stored(artifact_url, fingerprint, cur, conn)
         print(f"All artifact data added to database. Please move on to fill_media_table.py!\n\n\n")
+        database.close_database(cur, conn, ANALYZED_TABLES)
         quit()
 
-    insert_artifact_data(artifact_data=artifact_data, start=start, end=end, limit=25, cur=cur, conn=conn)
+    insert_artifact_data(artifact_data=artifact_data, start=start, end=end, limit=limit, cur=cur, conn=conn)
     cur.execute("SELECT max(id) FROM Artifacts")
     row = cur.fetchone()
     print(f"{row[0]} / 251 total rows of artifact data added to the database. Run the file again!\n")
 
     # CLose connection
-    conn.close()
+    database.close_database(cur, conn, ANALYZED_TABLES)
 
 if __name__ == "__main__":
-    main()
+    main(delta="--delta" in sys.argv, deep="--deep" in sys.argv)
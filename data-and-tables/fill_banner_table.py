@@ -1,62 +1,143 @@
-import sqlite3
+import sys
 import requests
+import database
+import http_client
+import batch_insert
+import dimension_cache
+import id_discovery
+import sync_state
 
-# Database Setup
-def set_up_database(db_name):
+
+##########################--BANNERS--#################################
+# Get the banner data
+def get_banner_data(banner_url, page_size=None, max_workers=None, adaptive=False, banner_ids=None):
     """
-    Sets up a SQLite database connection and cursor
+    Gets banner data from the GSHIMPACT API.
 
     ARGUMENTS:
-    db_name: str
-        The name of the SQLite database
+    banner_url: str
+        The base URL for the GSHImpact API
+    page_size: int
+        If given, banners are pulled in pages of this size from the paginated banners endpoint,
+        and only IDs missing from the pages are requested one by one
+    max_workers: int
+        Number of threads used for per-ID requests. If None, banners are fetched one at a time
+    adaptive: bool
+        If True, the number of requests in flight is adjusted between 1 and max_workers by an AIMD limiter
+    banner_ids: list
+        Banner IDs to fetch. If None, the live ID range is found with get_live_banner_ids
 
     RETURNS:
-    Tuple (Cursor, Connection):
-        A tuple containing the database cursor and connection objects.
+    all_media_data: list
+        List of GSHIMPACT json responses for each banner ID
     """
-    conn = sqlite3.connect(db_name)
-    cur = conn.cursor()
-    return cur, conn
-
-
-
-
-
+    return list(iter_banner_data(banner_url, page_size, max_workers, adaptive, banner_ids))
 
+def iter_banner_data(banner_url, page_size=None, max_workers=None, adaptive=False, banner_ids=None):
+    """
+    Generator version of get_banner_data. Yields each banner, in ID order, as soon as it
+    and every banner before it have been fetched
 
+    ARGUMENTS:
+        Same as get_banner_data
 
+    YIELDS:
+    banner_data: dict
+        GSHIMPACT json response for one banner
+    """
+    print(f"Banner data being gathered from the GSHImpact API! Please wait...")
+    if banner_ids is None:
+        banner_ids = get_live_banner_ids(banner_url)
+    banners_by_id = {}
+
+    if page_size:
+        for banner_data in http_client.get_pages(f"{banner_url}banners", page_size):
+            if banner_data.get('id') in banner_ids:
+                banners_by_id[banner_data['id']] = banner_data
+
+    # Fall back to per-ID requests for anything the pages did not cover
+    missing_ids = [banner_id for banner_id in banner_ids if banner_id not in banners_by_id]
+    fetched = iter_banners_by_id(banner_url, missing_ids, max_workers, adaptive)
+    try:
+        for banner_id in banner_ids:
+            if banner_id not in banners_by_id:
+                banners_by_id[banner_id] = next(fetched)
+            if banners_by_id[banner_id]:
+                yield banners_by_id[banner_id]
+    finally:
+        # also when the caller closes this generator early, which stops the remaining fetches
+        fetched.close()
+        print(f"Banner API call done! Adding rows to the database...")
+
+def get_live_banner_ids(banner_url):
+    """
+    Finds every banner ID the GSHIMPACT API currently serves, so new banners are picked up without code edits
 
+    ARGUMENTS:
+    banner_url: str
+        The base URL for the GSHImpact API
 
-##########################--BANNERS--#################################
-# Get the banner data
-def get_banner_data(banner_url):
+    RETURNS:
+    banner_ids: list
+        Banner IDs 1 to the current maximum. Exits if the range cannot be found, e.g. when the API is down
     """
-    Gets banner data from the GSHIMPACT API.
+    try:
+        max_id = id_discovery.discover_max_id(lambda banner_id: f"{banner_url}banners/{banner_id}/")
+    except requests.RequestException as e:
+        print(f"Could not find the banner IDs on the GSHImpact API: {e.__class__.__name__}. Run the file again later!")
+        sys.exit(1)
+    print(f"Found {max_id} banners on the GSHImpact API")
+    return list(range(1, max_id + 1))
+
+def iter_banners_by_id(banner_url, banner_ids, max_workers=None, adaptive=False, revalidate=False):
+    """
+    Generator that requests banners/{id}/ for each ID and yields the results in ID order
 
     ARGUMENTS:
     banner_url: str
         The base URL for the GSHImpact API
+    banner_ids: list
+        Banner IDs to fetch
+    max_workers, adaptive:
+        Same as get_banner_data
+    revalidate: bool
+        If True, cached responses are checked with the server again (see http_client.get)
+
+    YIELDS:
+    banner_data: dict or None
+        One entry per ID: the banner's 'result' object, or None if the request failed
+    """
+    banner_urls = [f"{banner_url}banners/{banner_id}/" for banner_id in banner_ids]
+    responses = http_client.iter_all(banner_urls, max_workers=max_workers, adaptive=adaptive, revalidate=revalidate)
+    for banner_id, response in zip(banner_ids, responses):
+        yield parse_banner_data(banner_id, response)
+
+def parse_banner_data(banner_id, response):
+    """
+    Parses a single GSHIMPACT banner response
+
+    ARGUMENTS:
+    banner_id: int
+        The banner ID the response was requested for
+    response: requests.Response
+        The response from the banners/{id}/ endpoint, or None if the request could not be completed
 
     RETURNS:
-    all_media_data: list
-        List of GSHIMPACT json responses for each banner ID
+    banner_data: dict or None
+        The banner's 'result' object, or None if the request failed
     """
-    print(f"Banner data being gathered from the GSHImpact API! Please wait...")
-    all_banner_data = []
-    for banner_id in range(1, 40):  # Loop through banner IDs
-        response = requests.get(f"{banner_url}banners/{banner_id}/")
-        if response.status_code != 200:
-            print(f"Failed to fetch data for banner ID {banner_id}, Status: {response.status_code}")
-            continue
-
-        banner_data = response.json().get('result', {})
-        if not banner_data:
-            print(f"No data found for banner ID {banner_id}")
-            continue
-        
-        all_banner_data.append(banner_data)
-    print(f"Banner API call done! Adding rows to the database...")
-    return all_banner_data
+    if response is None:
+        return None
+    if response.status_code != 200:
+        print(f"Failed to fetch data for banner ID {banner_id}, Status: {response.status_code}")
+        return None
+
+    banner_data = response.json().get('result', {})
+    if not banner_data:
+        print(f"No data found for banner ID {banner_id}")
+        return None
+    banner_data.setdefault('id', banner_id)
+    return banner_data
 
 # Setup Banner table
 def setup_banners_table(cur, conn):
@@ -87,15 +168,40 @@ def setup_banners_table(cur, conn):
         )
         """
     )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_banners_five_star ON Banners (five_star_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_banners_first_three_star ON Banners (first_three_star_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_banners_second_three_star ON Banners (second_three_star_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_banners_third_three_star ON Banners (third_three_star_id)")
     conn.commit()
 
+# Build the featured character IDs of one banner
+def banner_row(banner, characters):
+    """
+    Resolves a banner's featured characters to the four featured character columns of the Banners table.
+    Used by both the insert and the update, so a banner is written the same way whichever path writes it
+
+    ARGUMENTS:
+    banner: dict
+        GSHIMPACT json response for one banner
+    characters: dimension_cache.DimensionCache
+        Name -> id lookup for the Characters table
+
+    RETURNS:
+    row: tuple
+        Character IDs of the five star and the three featured three stars. Missing characters are None (NULL)
+    """
+    featured_names = [character["name"] for character in banner["featured"][:4]]
+    featured_names += [None] * (4 - len(featured_names))
+    return tuple(characters.get_id(name) for name in featured_names)
+
 # Insert the data into the Banners table
-def insert_banner_data(banner_data, start, end, limit, cur, conn):
+def insert_banner_data(banner_data, start, end, limit, cur, conn, batch_size=batch_insert.BATCH_SIZE):
     """
-    Inserts the media data for each character into the Media table.
+    Inserts the banner data into the Banners table, keyed by the upstream banner ID.
+    A banner already in the table is updated
 
     ARGUMENTS:
-    banner_data: list
+    banner_data: list or generator
         List of data for all banners, returned from get_banner_data
     start: int
         Integer starting point which to iterate from (remembers where it left off)
@@ -107,50 +213,126 @@ def insert_banner_data(banner_data, start, end, limit, cur, conn):
         SQLite cursor object
     conn:
         SQLite connection object
+    batch_size: int
+        Maximum number of banners written per transaction
     
     RETURNS:
         None
     """
-    # Default IDs to None (or NULL) for missing characters
-    five_star_name = None
-    first_three_star_name = None
-    second_three_star_name = None
-    third_three_star_name = None
-    
-    count = 0
-    for i in range(start, end):
-        if len(banner_data[i]["featured"]) >= 1:
-            five_star_name = banner_data[i]["featured"][0]["name"]
-        if len(banner_data[i]["featured"]) >= 2:
-            first_three_star_name = banner_data[i]["featured"][1]["name"]
-        if len(banner_data[i]["featured"]) >= 3:
-            second_three_star_name = banner_data[i]["featured"][2]["name"]
-        if len(banner_data[i]["featured"]) >= 4:
-            third_three_star_name = banner_data[i]["featured"][3]["name"]
-        
+    characters = dimension_cache.DimensionCache('Characters', 'name', cur)
+
+    def write_batch(banners):
+        rows = [(banner['id'], *banner_row(banner, characters)) for banner in banners]
+
+        # Banners.id is the upstream banner ID, so writing a banner again updates its row
+        cur.executemany(
+            """
+            INSERT INTO Banners
+            (id, five_star_id, first_three_star_id, second_three_star_id, third_three_star_id)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                five_star_id = excluded.five_star_id,
+                first_three_star_id = excluded.first_three_star_id,
+                second_three_star_id = excluded.second_three_star_id,
+                third_three_star_id = excluded.third_three_star_id
+            """,
+            rows
+        )
+        return cur.rowcount
+
+    batch_insert.insert_in_batches(banner_data, start, end, limit, write_batch, conn, batch_size)
+
+
+
+
+
+
+
+
+
+
+# Update existing rows in the Banners table
+def update_banner_data(banner_rows, cur, conn):
+    """
+    Updates banners that are already in the Banners table with freshly fetched data
+
+    ARGUMENTS:
+    banner_rows: list
+        List of (row id, banner data) tuples
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+
+    RETURNS:
+        None
+    """
+    characters = dimension_cache.DimensionCache('Characters', 'name', cur)
+    for row_id, banner in banner_rows:
         cur.execute(
             """
-            INSERT OR IGNORE INTO Banners
-            (five_star_id, first_three_star_id, second_three_star_id, third_three_star_id)
-            VALUES (
-                (SELECT id FROM Characters WHERE name = ?),
-                (SELECT id FROM Characters WHERE name = ?),
-                (SELECT id FROM Characters WHERE name = ?),
-                (SELECT id FROM Characters WHERE name = ?)
-            )
+            UPDATE Banners
+            SET five_star_id = ?,
+                first_three_star_id = ?,
+                second_three_star_id = ?,
+                third_three_star_id = ?
+            WHERE id = ?
             """,
-            (
-                five_star_name,
-                first_three_star_name,
-                second_three_star_name,
-                third_three_star_name
-            )
+            (*banner_row(banner, characters), row_id)
         )
-        conn.commit()
-        if cur.rowcount != 0:
-            count += 1
-        if count == limit:
-            break
+    conn.commit()
+
+# Get the rows in the Banners table
+def get_stored_banner_rows(cur):
+    """
+    Gets every row in the Banners table by its natural key, so delta sync can match upstream records to them
+
+    ARGUMENTS:
+    cur:
+        SQLite cursor object
+
+    RETURNS:
+    rows: dict
+        Dictionary where the keys are banner IDs and the values are row ids (the same IDs)
+    """
+    cur.execute("SELECT id FROM Banners")
+    return {row[0]: row[0] for row in cur.fetchall()}
+
+# Delta sync
+def delta_sync_banners(banner_url, limit, refresh_window, cur, conn):
+    """
+    Fetches and inserts only the banners that are not in the database yet, and refreshes the
+    most recently added ones
+
+    ARGUMENTS:
+    banner_url: str
+        The base URL for the GSHImpact API
+    limit: int
+        Maximum number of new banners to insert
+    refresh_window: int
+        Number of most recently synced banners to fetch again and update
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+
+    RETURNS:
+    Tuple (int, int):
+        Number of banners inserted and number of banners refreshed
+    """
+    return sync_state.delta_sync(
+        resource='banners',
+        all_keys=get_live_banner_ids(banner_url),
+        fetch=lambda banner_ids, revalidate=False: iter_banners_by_id(banner_url, banner_ids, max_workers=16,
+                                                                      adaptive=True, revalidate=revalidate),
+        insert=lambda banners: insert_banner_data(banners, 0, len(banners), limit, cur, conn),
+        update=lambda rows: update_banner_data(rows, cur, conn),
+        stored_rows=lambda: get_stored_banner_rows(cur),
+        cur=cur,
+        conn=conn,
+        limit=limit,
+        refresh_window=refresh_window
+    )
 
 
 
@@ -162,15 +344,17 @@ def insert_banner_data(banner_data, start, end, limit, cur, conn):
 
 
 ##########################--MAIN--#################################
-def main():
+def main(delta=False, refresh_window=5):
     '''
     Sets up database 
     Sets up banner table
     Calls functions
     Inserts information into database
+
+    With delta=True, only banners missing from the database (plus the last refresh_window ones) are fetched
     '''
     # Database setup
-    cur, conn = set_up_database("data-and-tables/genshin_impact_data.db")
+    cur, conn = database.set_up_database("data-and-tables/genshin_impact_data.db", profile=database.BULK)
     
     # Set up tables
     setup_banners_table(cur, conn)
@@ -182,7 +366,14 @@ def main():
 
 
     ##### Banners #####
-    banner_data = get_banner_data(banner_url)
+    if delta:
+        inserted, refreshed = delta_sync_banners(banner_url, 25, refresh_window, cur, conn)
+        print(f"Delta sync done: {inserted} banners added, {refreshed} refreshed.\n")
+        database.close_database(cur, conn, ['Banners'])
+        return
+
+    # banners are streamed: rows are inserted while the remaining banners are still being fetched
+    banner_data = iter_banner_data(banner_url, page_size=25, max_workers=16, adaptive=True)
 
     # Insert into database
     cur.execute("SELECT max(id) FROM Banners")
@@ -194,17 +385,21 @@ def main():
         start = row[0]
         end = 39
 
-    insert_banner_data(banner_data=banner_data, start=start, end=end, limit=25, cur=cur, conn=conn)
+    try:
+        insert_banner_data(banner_data=banner_data, start=start, end=end, limit=25, cur=cur, conn=conn)
+    finally:
+        # stops fetching past this run's rows, so the fetch reports print here before the summary
+        banner_data.close()
     if start >= 25:
         print(f"All banner data added to database. Please move on to fill_artifact_table.py!\n\n\n")
-        conn.close()
+        database.close_database(cur, conn, ['Banners'])
         quit()
     cur.execute("SELECT max(id) FROM Banners")
     row = cur.fetchone()
     print(f"{row[0]} / 39 total rows of banner data added to the database. Run the file again!\n")
 
     # Close connection
-    conn.close()
+    database.close_database(cur, conn, ['Banners'])
 
 if __name__ == "__main__":
-    main()
+    main(delta="--delta" in sys.argv)
@@ -1,67 +1,285 @@
-import sqlite3
+import sys
 import requests
+import database
+import http_client
+import http_archive
+import batch_insert
+import dimension_cache
+import natural_keys
+import id_discovery
+import sync_state
+import asyncio
+import functools
+import queue
+import threading
+import adaptive_concurrency
+from concurrent.futures import ThreadPoolExecutor
 
-# Database Setup
-def set_up_database(db_name):
+
+##########################--CHARACTERS--#################################
+def get_live_character_ids(character_url):
     """
-    Sets up a SQLite database connection and cursor
+    Finds every character ID the GSHIMPACT API currently serves, so new characters are picked up without code edits
 
     ARGUMENTS:
-    db_name: str
-        The name of the SQLite database
+    character_url: str
+        The base URL for the GSHImpact API
 
     RETURNS:
-    Tuple (Cursor, Connection):
-        A tuple containing the database cursor and connection objects
+    char_ids: list
+        Character IDs 1 to the current maximum. Exits if the range cannot be found, e.g. when the API is down
     """
-    conn = sqlite3.connect(db_name)
-    cur = conn.cursor()
-    return cur, conn
-
+    try:
+        max_id = id_discovery.discover_max_id(lambda char_id: f"{character_url}characters/{char_id}/")
+    except requests.RequestException as e:
+        print(f"Could not find the character IDs on the GSHImpact API: {e.__class__.__name__}. Run the file again later!")
+        sys.exit(1)
+    print(f"Found {max_id} characters on the GSHImpact API")
+    return list(range(1, max_id + 1))
+
+def parse_character_data(char_id, response):
+    """
+    Parses a single GSHIMPACT character response into a character row
 
+    ARGUMENTS:
+    char_id: int
+        The character ID the response was requested for
+    response: requests.Response
+        The response from the characters/{id}/ endpoint, or None if the request could not be completed
 
+    RETURNS:
+    character: dict or None
+        Dictionary with the character's name, rarity, vision and weapon, or None if the request failed
+    """
+    if response is None:
+        return None
+    if response.status_code != 200:
+        print(f"Failed to fetch data for character ID {char_id}, Status: {response.status_code}")
+        return None
 
+    character_data = response.json().get('result', {})  # Extract the 'result' field
+    if not character_data:
+        print(f"No data found for character ID {char_id}")
+        return None
 
+    return character_row(character_data)
 
+def character_row(character_data):
+    """
+    Converts a GSHIMPACT character object into a character row
 
+    ARGUMENTS:
+    character_data: dict
+        A character object from the characters/{id}/ or paginated characters endpoint
 
+    RETURNS:
+    character: dict
+        Dictionary with the character's name, rarity, vision and weapon
+    """
+    name = character_data.get('name')  # Fetch the name of the character
+    rarity = character_data.get('rarity', "0_star").split("_")[0]  # Extract number before '_star'
+    rarity = int(rarity)  # Convert to integer
+    vision = character_data.get('vision')
+    weapon = character_data.get('weapon')
 
+    return {'name':name, 'rarity':rarity, 'vision':vision, 'weapon':weapon}
 
-##########################--CHARACTERS--#################################
-def get_character_data(character_url):
+def get_character_data(character_url, concurrency=None, page_size=None, adaptive=False, char_ids=None):
     """
     Gets character data from the GSHIMPACT API.
 
     ARGUMENTS:
     character_url: str
         The base URL for the GSHImpact API
+    concurrency: int
+        Maximum number of requests in flight at once. If None, characters are fetched one at a time
+    page_size: int
+        If given, characters are pulled in pages of this size from the paginated characters endpoint,
+        and only IDs missing from the pages are requested one by one
+    adaptive: bool
+        If True, the number of requests in flight is adjusted between 1 and concurrency by an AIMD limiter
+    char_ids: list
+        Character IDs to fetch. If None, the live ID range is found with get_live_character_ids
 
     RETURNS:
     all_media_data: list
         List of GSHIMPACT json responses for each character ID
     """
+    return list(iter_character_data(character_url, concurrency, page_size, adaptive, char_ids))
+
+def iter_character_data(character_url, concurrency=None, page_size=None, adaptive=False, char_ids=None):
+    """
+    Generator version of get_character_data. Yields each character, in ID order, as soon as it
+    and every character before it have been fetched
+
+    ARGUMENTS:
+        Same as get_character_data
+
+    YIELDS:
+    character: dict
+        Dictionary with the character's name, rarity, vision and weapon
+    """
     print(f"Character data being gathered from the GSHImpact API! Please wait...")
-    all_character_data = []
-    for char_id in range(1, 52):  # Loop through character IDs 1 to 51
-        response = requests.get(f"{character_url}characters/{char_id}/")
-        if response.status_code != 200:
-            print(f"Failed to fetch data for character ID {char_id}, Status: {response.status_code}")
-            continue
-
-        character_data = response.json().get('result', {})  # Extract the 'result' field
-        if not character_data:
-            print(f"No data found for character ID {char_id}")
-            continue
-
-        name = character_data.get('name')  # Fetch the name of the character
-        rarity = character_data.get('rarity', "0_star").split("_")[0]  # Extract number before '_star'
-        rarity = int(rarity)  # Convert to integer
-        vision = character_data.get('vision')
-        weapon = character_data.get('weapon')
-
-        all_character_data.append({'name':name, 'rarity':rarity, 'vision':vision, 'weapon':weapon})
-    print(f"Character API call done! Adding items to the database...")
-    return all_character_data
+    if char_ids is None:
+        char_ids = get_live_character_ids(character_url)
+    characters_by_id = {}
+
+    if page_size:
+        for character_data in http_client.get_pages(f"{character_url}characters", page_size):
+            if character_data.get('id') in char_ids:
+                characters_by_id[character_data['id']] = character_row(character_data)
+
+    missing_ids = [char_id for char_id in char_ids if char_id not in characters_by_id]
+    fetched = iter_characters_by_id(character_url, missing_ids, concurrency, adaptive)
+    try:
+        for char_id in char_ids:
+            if char_id not in characters_by_id:
+                characters_by_id[char_id] = next(fetched)
+            if characters_by_id[char_id]:
+                yield characters_by_id[char_id]
+    finally:
+        # also when the caller closes this generator early, which stops the remaining fetches
+        fetched.close()
+        print(f"Character API call done! Adding items to the database...")
+
+def get_character_response(url, limiter=None, revalidate=False):
+    """
+    Requests one characters/{id}/ URL, treating a request that could not be completed
+    (connection error, timeout or open circuit) like any other failed request
+
+    ARGUMENTS:
+    url: str
+        The character URL
+    limiter: adaptive_concurrency.AdaptiveLimiter
+        Optional adaptive concurrency limiter shared by a batch of requests
+    revalidate: bool
+        If True, cached responses are checked with the server again (see http_client.get)
+
+    RETURNS:
+    response: requests.Response or None
+        The response, or None if the request could not be completed
+    """
+    try:
+        return http_client.get(url, limiter=limiter, revalidate=revalidate)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        print(f"Failed to fetch {url}: {e.__class__.__name__}")
+        return None
+
+def iter_characters_by_id(character_url, char_ids, concurrency=None, adaptive=False, revalidate=False):
+    """
+    Generator that requests characters/{id}/ for each ID and yields the results in ID order
+
+    ARGUMENTS:
+    character_url: str
+        The base URL for the GSHImpact API
+    char_ids: list
+        Character IDs to fetch
+    concurrency: int
+        Maximum number of requests in flight at once. If None, characters are fetched one at a time
+    adaptive: bool
+        If True, the number of requests in flight is adjusted between 1 and concurrency by an AIMD limiter
+    revalidate: bool
+        If True, cached responses are checked with the server again (see http_client.get)
+
+    YIELDS:
+    character: dict or None
+        One entry per ID: the character dictionary, or None if the request failed
+    """
+    if not concurrency:
+        for char_id in char_ids:
+            response = get_character_response(f"{character_url}characters/{char_id}/", revalidate=revalidate)
+            yield parse_character_data(char_id, response)
+        return
+
+    # Run the asyncio fetcher in a background thread and hand each result over through a queue.
+    # The limiter is created here, so its report is printed from this thread rather than the background one
+    results = queue.Queue()
+    stop = threading.Event()
+    limiter = adaptive_concurrency.AdaptiveLimiter(max_limit=concurrency) if adaptive else None
+
+    def run():
+        try:
+            asyncio.run(get_character_data_async(character_url, concurrency, char_ids, limiter=limiter, stop=stop,
+                                                 revalidate=revalidate,
+                                                 on_result=lambda char_id, character: results.put((char_id, character, None))))
+        except Exception as e:
+            results.put((None, None, e))
+
+    fetcher = threading.Thread(target=run, daemon=True)
+    fetcher.start()
+    try:
+        ready = {}
+        for char_id in char_ids:
+            while char_id not in ready:
+                done_id, character, error = results.get()
+                if error:
+                    raise error
+                ready[done_id] = character
+            yield ready.pop(char_id)
+    finally:
+        # also when the caller closes this generator early: skip the IDs that have not started yet,
+        # unless the responses are being recorded, which should cover every ID
+        if http_archive.MODE != http_archive.RECORD:
+            stop.set()
+        fetcher.join()
+        if limiter:
+            print(f"Adaptive concurrency settled at {limiter.current_limit()} requests in flight")
+
+async def get_character_data_async(character_url, concurrency=10, char_ids=None, adaptive=False, on_result=None,
+                                   limiter=None, stop=None, revalidate=False):
+    """
+    Gets character data from the GSHIMPACT API with up to `concurrency` requests running in parallel
+
+    ARGUMENTS:
+    character_url: str
+        The base URL for the GSHImpact API
+    concurrency: int
+        Maximum number of requests in flight at once
+    char_ids: list
+        Character IDs to fetch. If None, the live ID range is found with get_live_character_ids
+    adaptive: bool
+        If True, the number of requests in flight is adjusted between 1 and concurrency by an AIMD limiter
+    on_result: function
+        Optional callback, called as on_result(char_id, character) as soon as each character finishes
+    limiter: adaptive_concurrency.AdaptiveLimiter
+        Limiter to use instead of creating one for adaptive. The caller reports its final limit
+    stop: threading.Event
+        If given and set, IDs that have not been requested yet are skipped and come back as None
+    revalidate: bool
+        If True, cached responses are checked with the server again (see http_client.get)
+
+    RETURNS:
+    all_character_data: list
+        One entry per requested ID, in the same order: the character dictionary, or None if the request failed
+    """
+    if char_ids is None:
+        char_ids = get_live_character_ids(character_url)
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    report = limiter is None and adaptive
+    if report:
+        limiter = adaptive_concurrency.AdaptiveLimiter(max_limit=concurrency)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        async def fetch_character(char_id):
+            async with semaphore:
+                if stop is not None and stop.is_set():
+                    return None
+                fetch = functools.partial(get_character_response, f"{character_url}characters/{char_id}/",
+                                          limiter=limiter, revalidate=revalidate)
+                response = await loop.run_in_executor(executor, fetch)
+            character = parse_character_data(char_id, response)
+            if on_result:
+                on_result(char_id, character)
+            return character
+
+        # gather keeps the results in the same order as the IDs
+        results = await asyncio.gather(*(fetch_character(char_id) for char_id in char_ids))
+
+    if report:
+        print(f"Adaptive concurrency settled at {limiter.current_limit()} requests in flight")
+
+    return list(results)
 
 # Setup Character tables
 def setup_character_tables(cur, conn):
@@ -91,6 +309,7 @@ def setup_character_tables(cur, conn):
         """
     )
     conn.commit()
+    natural_keys.add_natural_key('Characters', ['name'], cur, conn)
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS CharacterVisions (
@@ -101,93 +320,159 @@ def setup_character_tables(cur, conn):
     )
     conn.commit()
 
-# Insert the character visions data into the CharacterVisions table
-def insert_character_vision_table(character_data, cur, conn):
+# Insert character data into Characters table
+def insert_character_data(character_data, start, end, limit, cur, conn, batch_size=batch_insert.BATCH_SIZE):
     """
-    Inserts the character visions data into the CharacterVisions table
+    Inserts the character data into the Characters table. A character already in the table (by name) is updated
 
     ARGUMENTS:
-    character_data: list
+    character_data: list or generator
         List of data for all characters, returned from get_character_data
+    start: int
+        Integer starting point which to iterate from (remembers where it left off)
+    end: int
+        Integer upper bound of where to iterate through (maximum number of items the API supplies)
+    limit: int
+        Integer limit of how many items can be returned
     cur:
-        SQLite cursor
+        SQLite cursor object
     conn:
-        SQLite connection
+        SQLite connection object
+    batch_size: int
+        Maximum number of characters written per transaction
     
     RETURNS:
         None
     """
+    visions = dimension_cache.DimensionCache('CharacterVisions', 'vision', cur)
+    weapon_types = dimension_cache.DimensionCache('WeaponTypes', 'weapon_type', cur)
 
-    character_visions = []
-    for character in character_data:
-        # print(f"char vision is {character['vision']}")
-        if character['vision'] not in character_visions:
-            character_visions.append(character['vision'])
-        if len(character_visions) == 7:
-            break
-        else:
-            continue
-
-    for vision in character_visions:
-        cur.execute(
-            """
-            INSERT OR IGNORE INTO CharacterVisions (vision)
-            VALUES (?)
+    def write_batch(characters):
+        # Add each vision the first time it shows up, so rows can be inserted while characters are still streaming in
+        rows = [
+            (
+                character['name'],
+                character['rarity'],
+                visions.get_or_insert_id(character['vision']),
+                weapon_types.get_id(character['weapon'])
+            )
+            for character in characters
+        ]
+        cur.executemany(
+            """ 
+            INSERT INTO Characters 
+            (name, rarity, vision_id, weapon_id)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET
+                rarity = excluded.rarity,
+                vision_id = excluded.vision_id,
+                weapon_id = excluded.weapon_id
             """,
-            (vision, )
+            rows
         )
-        conn.commit()
+        return cur.rowcount
 
+    batch_insert.insert_in_batches(character_data, start, end, limit, write_batch, conn, batch_size)
 
-# Insert character data into Characters table
-def insert_character_data(character_data, start, end, limit, cur, conn):
+
+
+
+
+
+
+
+
+
+# Update existing rows in the Characters table
+def update_character_data(character_rows, cur, conn):
     """
-    Inserts the character data into the Characters table.
+    Updates characters that are already in the Characters table with freshly fetched data
 
     ARGUMENTS:
-    character_data: list
-        List of data for all characters, returned from get_character_data
-    start: int
-        Integer starting point which to iterate from (remembers where it left off)
-    end: int
-        Integer upper bound of where to iterate through (maximum number of items the API supplies)
-    limit: int
-        Integer limit of how many items can be returned
+    character_rows: list
+        List of (row id, character data) tuples
     cur:
         SQLite cursor object
     conn:
         SQLite connection object
-    
+
     RETURNS:
         None
     """
-    count = 0
-    for i in range(start, end):
-        # print(f"Adding character {start+count}, which is {character_data[i]['name']}")
-        # print(f"ending on {end}")
+    visions = dimension_cache.DimensionCache('CharacterVisions', 'vision', cur)
+    weapon_types = dimension_cache.DimensionCache('WeaponTypes', 'weapon_type', cur)
+    for row_id, character in character_rows:
         cur.execute(
-            """ 
-            INSERT OR IGNORE INTO Characters 
-            (name, rarity, vision_id, weapon_id)
-            VALUES (
-                ?,
-                ?,
-                (SELECT id FROM CharacterVisions WHERE vision = ?),
-                (SELECT id FROM WeaponTypes WHERE weapon_type = ?)
-            )
+            """
+            UPDATE Characters
+            SET name = ?,
+                rarity = ?,
+                vision_id = ?,
+                weapon_id = ?
+            WHERE id = ?
             """,
             (
-                character_data[i]['name'],
-                character_data[i]['rarity'],
-                character_data[i]['vision'],
-                character_data[i]['weapon']
+                character['name'],
+                character['rarity'],
+                visions.get_or_insert_id(character['vision']),
+                weapon_types.get_id(character['weapon']),
+                row_id
             )
         )
-        conn.commit()
-        if cur.rowcount != 0:
-            count += 1
-        if count == limit:
-            break
+    conn.commit()
+
+# Get the rows in the Characters table
+def get_stored_character_rows(cur):
+    """
+    Gets every row in the Characters table by its natural key, so delta sync can match upstream records to them
+
+    ARGUMENTS:
+    cur:
+        SQLite cursor object
+
+    RETURNS:
+    rows: dict
+        Dictionary where the keys are character names and the values are row ids
+    """
+    cur.execute("SELECT name, id FROM Characters")
+    return dict(cur.fetchall())
+
+# Delta sync
+def delta_sync_characters(character_url, limit, refresh_window, cur, conn):
+    """
+    Fetches and inserts only the characters that are not in the database yet, and refreshes the
+    most recently added ones
+
+    ARGUMENTS:
+    character_url: str
+        The base URL for the GSHImpact API
+    limit: int
+        Maximum number of new characters to insert
+    refresh_window: int
+        Number of most recently synced characters to fetch again and update
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+
+    RETURNS:
+    Tuple (int, int):
+        Number of characters inserted and number of characters refreshed
+    """
+    return sync_state.delta_sync(
+        resource='characters',
+        all_keys=get_live_character_ids(character_url),
+        fetch=lambda char_ids, revalidate=False: iter_characters_by_id(character_url, char_ids, concurrency=10,
+                                                                       adaptive=True, revalidate=revalidate),
+        insert=lambda characters: insert_character_data(characters, 0, len(characters), limit, cur, conn),
+        update=lambda rows: update_character_data(rows, cur, conn),
+        stored_rows=lambda: get_stored_character_rows(cur),
+        cur=cur,
+        conn=conn,
+        limit=limit,
+        refresh_window=refresh_window,
+        record_key=lambda character: character['name']
+    )
 
 
 
@@ -199,15 +484,17 @@ def insert_character_data(character_data, start, end, limit, cur, conn):
 
 
 ##########################--MAIN--#################################
-def main():
+def main(delta=False, refresh_window=5):
     '''
     Sets up database 
     Sets up character tables
     Calls functions
     Inserts information into database
+
+    With delta=True, only characters missing from the database (plus the last refresh_window ones) are fetched
     '''
     # Database setup
-    cur, conn = set_up_database("data-and-tables/genshin_impact_data.db")
+    cur, conn = database.set_up_database("data-and-tables/genshin_impact_data.db", profile=database.BULK)
     
     # Set up tables
     setup_character_tables(cur, conn)
@@ -219,22 +506,33 @@ def main():
 
 
     ##### characters #####
-    character_data = get_character_data(character_url)
+    if delta:
+        inserted, refreshed = delta_sync_characters(character_url, 25, refresh_window, cur, conn)
+        print(f"Delta sync done: {inserted} characters added, {refreshed} refreshed.\n")
+        database.close_database(cur, conn, ['Characters'])
+        return
+
+    # characters are streamed: rows are inserted while the remaining characters are still being fetched
+    character_data = iter_character_data(character_url, concurrency=10, page_size=25, adaptive=True)
 
     # insert into 
     cur.execute("SELECT max(id) FROM Characters")
     row = cur.fetchone()
     if row is None or row[0] is None:
-        insert_character_vision_table(character_data, cur, conn)
         start = 0
         end = 18
     else:
         start = row[0]
         end = 51
 
-    insert_character_data(character_data=character_data, start=start, end=end, limit=25, cur=cur, conn=conn)
+    try:
+        insert_character_data(character_data=character_data, start=start, end=end, limit=25, cur=cur, conn=conn)
+    finally:
+        # stops fetching past this run's rows, so the fetch reports print here before the summary
+        character_data.close()
     if start >= 43:
         print(f"All character data added to the database. Please move on to fill_banner_table.py!\n\n\n")
+        database.close_database(cur, conn, ['Characters'])
         quit()
     cur.execute("SELECT max(id) FROM Characters")
     row = cur.fetchone()
@@ -242,7 +540,7 @@ def main():
 
     
     # Close connection
-    conn.close()
+    database.close_database(cur, conn, ['Characters'])
 
 if __name__ == "__main__":
-    main()
+    main(delta="--delta" in sys.argv)
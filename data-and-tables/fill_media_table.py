@@ -1,30 +1,10 @@
-import sqlite3
-import requests
-
-# Database Setup
-def set_up_database(db_name):
-    """
-    Sets up a SQLite database connection and cursor
-
-    ARGUMENTS:
-    db_name: str
-        The name of the SQLite database
-
-    RETURNS:
-    Tuple (Cursor, Connection):
-        A tuple containing the database cursor and connection objects
-    """
-    conn = sqlite3.connect(db_name)
-    cur = conn.cursor()
-    return cur, conn
-
-
-
-
-
-
-
-
+import sys
+import database
+import http_client
+import batch_insert
+import dimension_cache
+import natural_keys
+import sync_state
 
 
 ##########################--MEDIA--#################################
@@ -41,11 +21,11 @@ def get_character_ids(cur):
     character_ids: list
         A list containing the integer character ID's from the Characters table
     """
-    character_ids = [char_id[0] for char_id in cur.execute("SELECT id FROM Characters")]
+    character_ids = [char_id[0] for char_id in cur.execute("SELECT id FROM Characters ORDER BY id")]
     return character_ids
 
 # Get the media
-def get_media_data(character_ids, url):
+def get_media_data(character_ids, url, max_workers=None, adaptive=False):
     """
     Fetches media data from the GSHIMPACT API for all character ids in the database
 
@@ -54,23 +34,65 @@ def get_media_data(character_ids, url):
         Every character ID from the dataset, returned from get_character_ids
     character_url: str
         The base URL for the GSHImpact API
+    max_workers: int
+        Number of threads fetching media in parallel. If None, media is fetched one character at a time
+    adaptive: bool
+        If True, the number of requests in flight is adjusted between 1 and max_workers by an AIMD limiter
 
     RETURNS:
     all_media_data: list
         List of GSHIMPACT json responses for each character ID
     """
+    return list(iter_media_data(character_ids, url, max_workers, adaptive))
+
+def iter_media_data(character_ids, url, max_workers=None, adaptive=False):
+    """
+    Generator version of get_media_data. Yields each character's media, in the order of character_ids,
+    as soon as it and everything before it have been fetched
+
+    ARGUMENTS:
+        Same as get_media_data
+
+    YIELDS:
+    media_data: dict
+        GSHIMPACT json response for one character's media
+    """
     print(f"Media data being gathered from the GSHImpact API! Please wait...")
-    all_media_data = []
-    for id in character_ids:
-        media_url = f"{url}characters/{id}/media"
-        response = requests.get(media_url)
-        
-        if response.status_code == 200:
-            media_data = response.json().get("result", {})
-        
-        all_media_data.append(media_data)
-    print(f"Media API call done! Adding rows to the database...")
-    return all_media_data
+    fetched = iter_media_by_id(character_ids, url, max_workers, adaptive)
+    try:
+        for media_data in fetched:
+            if media_data is not None:
+                yield media_data
+    finally:
+        # also when the caller closes this generator early, which stops the remaining fetches
+        fetched.close()
+        print(f"Media API call done! Adding rows to the database...")
+
+def iter_media_by_id(character_ids, url, max_workers=None, adaptive=False, revalidate=False):
+    """
+    Generator that requests characters/{id}/media for each character ID
+
+    ARGUMENTS:
+    character_ids, url, max_workers, adaptive:
+        Same as get_media_data
+    revalidate: bool
+        If True, cached responses are checked with the server again (see http_client.get)
+
+    YIELDS:
+    media_data: dict or None
+        One entry per character ID, in the same order: the media 'result' object, or None if the request failed
+    """
+    media_urls = [f"{url}characters/{id}/media" for id in character_ids]
+    responses = http_client.iter_all(media_urls, max_workers=max_workers, adaptive=adaptive, revalidate=revalidate)
+
+    for id, response in zip(character_ids, responses):
+        if response is None:
+            yield None
+        elif response.status_code != 200:
+            print(f"Failed to fetch media for character ID {id}, Status: {response.status_code}")
+            yield None
+        else:
+            yield response.json().get("result", {})
 
 # Setup Media table
 def setup_media_table(cur, conn):
@@ -101,14 +123,15 @@ def setup_media_table(cur, conn):
         """
     )
     conn.commit()
+    natural_keys.add_natural_key('Media', ['character_id'], cur, conn, keep_latest=True)
 
 # Insert the data into the Media table
-def insert_media_data(media_data, start, end, limit, cur, conn):
+def insert_media_data(media_data, start, end, limit, cur, conn, batch_size=batch_insert.BATCH_SIZE):
     """
     Inserts the media data for each character into the Media table
 
     ARGUMENTS:
-    media_data: list
+    media_data: list or generator
         List of media data for all characters, returned from get_media_data
     start: int
         Integer starting point which to iterate from (remembers where it left off)
@@ -120,52 +143,152 @@ def insert_media_data(media_data, start, end, limit, cur, conn):
         SQLite cursor object
     conn:
         SQLite connection object
+    batch_size: int
+        Maximum number of characters' media written per transaction
     
     RETURNS:
         None
     """
-    
-    count = 0
-    for i in range(start, end):
+    characters = dimension_cache.DimensionCache('Characters', 'name', cur)
+
+    def write_batch(media_batch):
         # Get the count of items in each media type
-        character_name = media_data[i]['character']['name']
-        promotion_count = len(media_data[i].get("promotion", []))
-        holiday_count = len(media_data[i].get("holiday", []))
-        birthday_count = len(media_data[i].get("birthday", []))
-        videos_count = len(media_data[i].get("videos", []))
-        cameos_count = len(media_data[i].get("cameos", []))
-        artwork_count = len(media_data[i].get("artwork", []))
+        rows = [
+            (
+                characters.get_id(media['character']['name']),
+                len(media.get("promotion", [])),
+                len(media.get("holiday", [])),
+                len(media.get("birthday", [])),
+                len(media.get("videos", [])),
+                len(media.get("cameos", [])),
+                len(media.get("artwork", [])),
+            )
+            for media in media_batch
+        ]
 
         # Insert or update the data in the Media table
-        cur.execute(
+        # (an upsert keeps the row in place, OR REPLACE would delete it and append a new one)
+        cur.executemany(
             """
-            INSERT OR REPLACE INTO Media
+            INSERT INTO Media
             (character_id, promotion, holiday, birthday, videos, cameos, artwork)
-            VALUES (
-                (SELECT id FROM Characters WHERE name = ?),
-                ?,
-                ?,
-                ?,
-                ?,
-                ?,
-                ?
-            )
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (character_id) DO UPDATE SET
+                promotion = excluded.promotion,
+                holiday = excluded.holiday,
+                birthday = excluded.birthday,
+                videos = excluded.videos,
+                cameos = excluded.cameos,
+                artwork = excluded.artwork
+            """,
+            rows
+        )
+        return cur.rowcount
+
+    batch_insert.insert_in_batches(media_data, start, end, limit, write_batch, conn, batch_size)
+
+
+
+
+
+
+
+
+
+
+# Update existing rows in the Media table
+def update_media_data(media_rows, cur, conn):
+    """
+    Updates media rows that are already in the Media table with freshly fetched data
+
+    ARGUMENTS:
+    media_rows: list
+        List of (row id, media data) tuples
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+
+    RETURNS:
+        None
+    """
+    for row_id, media in media_rows:
+        cur.execute(
+            """
+            UPDATE Media
+            SET promotion = ?,
+                holiday = ?,
+                birthday = ?,
+                videos = ?,
+                cameos = ?,
+                artwork = ?
+            WHERE rowid = ?
             """,
             (
-                character_name,
-                promotion_count,
-                holiday_count,
-                birthday_count,
-                videos_count,
-                cameos_count,
-                artwork_count,
+                len(media.get("promotion", [])),
+                len(media.get("holiday", [])),
+                len(media.get("birthday", [])),
+                len(media.get("videos", [])),
+                len(media.get("cameos", [])),
+                len(media.get("artwork", [])),
+                row_id
             )
         )
-        conn.commit()
-        if cur.rowcount != 0:
-            count += 1
-        if count == limit:
-            break
+    conn.commit()
+
+# Get the rows in the Media table
+def get_stored_media_rows(cur):
+    """
+    Gets every row in the Media table by its natural key, so delta sync can match upstream records to them
+
+    ARGUMENTS:
+    cur:
+        SQLite cursor object
+
+    RETURNS:
+    rows: dict
+        Dictionary where the keys are character IDs and the values are row ids
+    """
+    cur.execute("SELECT character_id, rowid FROM Media")
+    return dict(cur.fetchall())
+
+# Delta sync
+def delta_sync_media(character_ids, url, limit, refresh_window, cur, conn):
+    """
+    Fetches and inserts media only for characters that are not in the Media table yet, and refreshes the
+    most recently added ones
+
+    ARGUMENTS:
+    character_ids: list
+        Every character ID from the dataset, returned from get_character_ids
+    url: str
+        The base URL for the GSHImpact API
+    limit: int
+        Maximum number of new media rows to insert
+    refresh_window: int
+        Number of most recently synced characters whose media is fetched again and updated
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+
+    RETURNS:
+    Tuple (int, int):
+        Number of media rows inserted and number of media rows refreshed
+    """
+    return sync_state.delta_sync(
+        resource='media',
+        all_keys=character_ids,
+        fetch=lambda ids, revalidate=False: iter_media_by_id(ids, url, max_workers=16, adaptive=True,
+                                                             revalidate=revalidate),
+        insert=lambda media: insert_media_data(media, 0, len(media), limit, cur, conn),
+        update=lambda rows: update_media_data(rows, cur, conn),
+        stored_rows=lambda: get_stored_media_rows(cur),
+        cur=cur,
+        conn=conn,
+        limit=limit,
+        refresh_window=refresh_window
+    )
 
 
 
@@ -177,16 +300,17 @@ def insert_media_data(media_data, start, end, limit, cur, conn):
 
 
 ##########################--MAIN--#################################
-def main():
+def main(delta=False, refresh_window=5):
     '''
     Sets up database 
     Sets up media table
     Calls functions
     Inserts information into database
 
+    With delta=True, only media for characters missing from the Media table (plus the last refresh_window ones) is fetched
     '''
     # Set up database
-    cur, conn = set_up_database("data-and-tables/genshin_impact_data.db")
+    cur, conn = database.set_up_database("data-and-tables/genshin_impact_data.db", profile=database.BULK)
     
     # Set up table
     setup_media_table(cur, conn)
@@ -199,7 +323,14 @@ def main():
 
     ##### Media #####
     character_ids = get_character_ids(cur)
-    media_data = get_media_data(character_ids, url)
+    if delta:
+        inserted, refreshed = delta_sync_media(character_ids, url, 25, refresh_window, cur, conn)
+        print(f"Delta sync done: {inserted} media rows added, {refreshed} refreshed.\n")
+        database.close_database(cur, conn, ['Media'])
+        return
+
+    # media is streamed: rows are inserted while the remaining media is still being fetched
+    media_data = iter_media_data(character_ids, url, max_workers=16, adaptive=True)
 
     # Insert into database
     cur.execute("SELECT max(character_id) FROM Media")
@@ -211,17 +342,21 @@ def main():
         start = row[0]
         end = 30
 
-    insert_media_data(media_data=media_data, start=start, end=end, limit=25, cur=cur, conn=conn)
+    try:
+        insert_media_data(media_data=media_data, start=start, end=end, limit=25, cur=cur, conn=conn)
+    finally:
+        # stops fetching past this run's rows, so the fetch reports print here before the summary
+        media_data.close()
     if start >= 25:
         print(f"All media data added to database. Please move on to calculations.py in the calculations folder!\n\n\n")
-        conn.close()
+        database.close_database(cur, conn, ['Media'])
         quit()
     cur.execute("SELECT max(character_id) FROM Media")
     row = cur.fetchone()
     print(f"{row[0]} / 30 total media items added to the database. Run the file again!")
 
     # Close connection
-    conn.close()
+    database.close_database(cur, conn, ['Media'])
 
 if __name__ == "__main__":
-    main()
+    main(delta="--delta" in sys.argv)
@@ -1,70 +1,111 @@
-import sqlite3
-import requests
+import sys
+import database
+import http_client
+import batch_insert
+import dimension_cache
+import natural_keys
+import sync_state
 from bs4 import BeautifulSoup
 
-# Database Setup
-def set_up_database(db_name):
+
+###################--WEAPONS--#################################
+# Get the weapon data
+def get_weapon_data(weapon_url, max_workers=None, timeout=None, adaptive=False):
     """
-    Sets up a SQLite database connection and cursor
+    Gets weapon data from the Genshin.dev for all character ids in the database
 
     ARGUMENTS:
-    -----------------------
-    db_name: str
-        The name of the SQLite database
+    weapon_url: str
+        The base URL for the Genshin.dev API
+    max_workers: int
+        Number of threads used to fetch weapon details in parallel. If None, weapons are fetched one at a time
+    timeout: float
+        Per-request timeout in seconds. If None, http_client.TIMEOUT is used
+    adaptive: bool
+        If True, the number of requests in flight is adjusted between 1 and max_workers by an AIMD limiter
 
     RETURNS:
-    -----------------------
-    Tuple (Cursor, Connection):
-        A tuple containing the database cursor and connection objects
+    all_media_data: list
+        List of Genshin.dev json responses for each weapon
     """
-    conn = sqlite3.connect(db_name)
-    cur = conn.cursor()
-    return cur, conn
-
-
-
-
-
-
-
+    return list(iter_weapon_data(weapon_url, max_workers, timeout, adaptive))
 
+def iter_weapon_data(weapon_url, max_workers=None, timeout=None, adaptive=False):
+    """
+    Generator version of get_weapon_data. Yields each weapon as soon as it has been fetched,
+    so rows can be inserted while the rest are still downloading
 
+    ARGUMENTS:
+        Same as get_weapon_data
 
-###################--WEAPONS--#################################
-# Get the weapon data
-def get_weapon_data(weapon_url):
+    YIELDS:
+    weapon_data: dict
+        Genshin.dev json response for one weapon, in the order of the weapons/ index
     """
-    Gets weapon data from the Genshin.dev for all character ids in the database
+    print(f"Weapon data being gathered from the Genshin.dev API! Please wait...")
+    weapon_names = get_weapon_names(weapon_url, timeout)
+    weapon_details = iter_weapon_details(weapon_url, weapon_names, max_workers, timeout, adaptive)
+    try:
+        for weapon_data in weapon_details:
+            if weapon_data is not None:
+                yield weapon_data
+    finally:
+        # also when the caller closes this generator early, which stops the remaining fetches
+        weapon_details.close()
+        print(f"Weapon API call done! Adding rows to the database...")
+
+def get_weapon_names(weapon_url, timeout=None):
+    """
+    Gets the names of every weapon from the Genshin.dev weapons/ index
 
     ARGUMENTS:
     weapon_url: str
         The base URL for the Genshin.dev API
+    timeout: float
+        Per-request timeout in seconds. If None, http_client.TIMEOUT is used
 
     RETURNS:
-    all_media_data: list
-        List of Genshin.dev json responses for each weapon
+    weapon_names: list
+        List of weapon names (e.g. 'a-thousand-floating-dreams'), in index order
     """
-    print(f"Weapon data being gathered from the Genshin.dev API! Please wait...")
-    response = requests.get(f"{weapon_url}weapons/")
+    response = http_client.get(f"{weapon_url}weapons/", timeout=timeout)
     if response.status_code != 200:
         print(f"Error fetching weapon names: {response.status_code}")
         return []
     weapon_names = response.json()
     weapon_names.remove('blackcliff-agate') # remove dupe - API limitation
+    return weapon_names
 
-    all_weapon_data = []
-    # ct = 1    # used for development
-    for weapon_name in weapon_names:
-        response = requests.get(f"{weapon_url}weapons/{weapon_name}/")
-        if response.status_code != 200:
+def iter_weapon_details(weapon_url, weapon_names, max_workers=None, timeout=None, adaptive=False, revalidate=False):
+    """
+    Generator that requests weapons/{name}/ for each weapon name
+
+    ARGUMENTS:
+    weapon_url: str
+        The base URL for the Genshin.dev API
+    weapon_names: list
+        Weapon names to fetch, returned from get_weapon_names
+    max_workers, timeout, adaptive:
+        Same as get_weapon_data
+    revalidate: bool
+        If True, cached responses are checked with the server again (see http_client.get)
+
+    YIELDS:
+    weapon_data: dict or None
+        One entry per name, in the same order: the Genshin.dev json response, or None if the request failed
+    """
+    # iter_all yields responses in the same order as weapon_names, so inserted IDs stay stable
+    weapon_urls = [f"{weapon_url}weapons/{weapon_name}/" for weapon_name in weapon_names]
+    responses = http_client.iter_all(weapon_urls, max_workers=max_workers, timeout=timeout, adaptive=adaptive,
+                                     revalidate=revalidate)
+    for weapon_name, response in zip(weapon_names, responses):
+        if response is None:
+            yield None
+        elif response.status_code != 200:
             print(f"Failed to fetch data for weapon: {weapon_name}, Status: {response.status_code}")
-            continue
-        weapon_data = response.json()
-        all_weapon_data.append(weapon_data)
-        # print(f"Data for {ct}/{len(weapon_names)} weapons gathered")    # used for development
-        # ct+=1    # used for development
-    print(f"Weapon API call done! Adding rows to the database...")
-    return all_weapon_data
+            yield None
+        else:
+            yield response.json()
 
 # Create the Weapons table
 def setup_weapons_tables(cur, conn):
@@ -93,6 +134,8 @@ def setup_weapons_tables(cur, conn):
         """
     )
     conn.commit()
+    natural_keys.add_natural_key('Weapons', ['name', 'rarity'], cur, conn)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_weapons_type_rarity ON Weapons (weapon_type_id, rarity)")
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS WeaponTypes (
@@ -103,90 +146,157 @@ def setup_weapons_tables(cur, conn):
     )
     conn.commit()
 
-# Insert the weapon type data into the WeaponTypes table
-def insert_weapon_type_data(weapon_data, cur, conn):
+# Insert the data into the Weapons table
+def insert_weapon_data(weapon_data, start, end, limit, cur, conn, batch_size=batch_insert.BATCH_SIZE):
     """
-    Inserts the weapon type data into the WeaponTypes table
+    Inserts the weapon data into the Weapons table. A weapon already in the table (same name and rarity) is updated
 
     ARGUMENTS:
-    weapon_data: list
+    weapon_data: list or generator
         List of data for all weapons, returned from get_weapon_data
+    start: int
+        Integer starting point which to iterate from (remembers where it left off)
+    end: int
+        Integer upper bound of where to iterate through (maximum number of items the API supplies)
+    limit: int
+        Integer limit of how many items can be returned
     cur:
-        SQLite cursor
+        SQLite cursor object
     conn:
-        SQLite connection
+        SQLite connection object
+    batch_size: int
+        Maximum number of weapons written per transaction
     
     RETURNS:
         None
     """
+    weapon_types = dimension_cache.DimensionCache('WeaponTypes', 'weapon_type', cur)
 
-    weapon_types = []
-    for weapon in weapon_data:
-        if weapon['type'] not in weapon_types:
-            weapon_types.append(weapon['type'])
-        if len(weapon_types) == 5:
-            break
-        else:
-            continue
-
-    for weapon_type in weapon_types:
-        cur.execute(
-            """
-            INSERT OR IGNORE INTO WeaponTypes (weapon_type)
-            VALUES (?)
+    def write_batch(weapons):
+        # Add each weapon type the first time it shows up, so rows can be inserted while weapons are still streaming in
+        rows = [
+            (
+                weapon['name'],
+                weapon_types.get_or_insert_id(weapon['type']),
+                weapon['rarity'],
+                weapon['baseAttack']
+            )
+            for weapon in weapons
+        ]
+        cur.executemany(
+            """ 
+            INSERT INTO Weapons 
+            (name, weapon_type_id, rarity, base_attack)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (name, rarity) DO UPDATE SET
+                weapon_type_id = excluded.weapon_type_id,
+                base_attack = excluded.base_attack
             """,
-            (weapon_type, )
+            rows
         )
-        conn.commit()
+        return cur.rowcount
 
-# Insert the data into the Weapons table
-def insert_weapon_data(weapon_data, start, end, limit, cur, conn):
+    batch_insert.insert_in_batches(weapon_data, start, end, limit, write_batch, conn, batch_size)
+
+
+
+
+
+
+
+
+
+
+# Update existing rows in the Weapons table
+def update_weapon_data(weapon_rows, cur, conn):
     """
-    Inserts the weapon data into the Weapons table
+    Updates weapons that are already in the Weapons table with freshly fetched data
 
     ARGUMENTS:
-    weapon_data: list
-        List of data for all weapons, returned from get_weapon_data
-    start: int
-        Integer starting point which to iterate from (remembers where it left off)
-    end: int
-        Integer upper bound of where to iterate through (maximum number of items the API supplies)
-    limit: int
-        Integer limit of how many items can be returned
+    weapon_rows: list
+        List of (row id, weapon data) tuples
     cur:
         SQLite cursor object
     conn:
         SQLite connection object
-    
+
     RETURNS:
         None
     """
-    count = 0
-    for i in range(start, end):
-        # print(f"starting on weapon {start+count}, which is {weapon_data[i]['name']}")
+    weapon_types = dimension_cache.DimensionCache('WeaponTypes', 'weapon_type', cur)
+    for row_id, weapon in weapon_rows:
         cur.execute(
-            """ 
-            INSERT OR IGNORE INTO Weapons 
-            (name, weapon_type_id, rarity, base_attack)
-            VALUES (
-                ?,
-                (SELECT id FROM WeaponTypes WHERE weapon_type = ?), 
-                ?, 
-                ?
-            )
+            """
+            UPDATE Weapons
+            SET name = ?,
+                weapon_type_id = ?,
+                rarity = ?,
+                base_attack = ?
+            WHERE id = ?
             """,
             (
-                weapon_data[i]['name'],
-                weapon_data[i]['type'],
-                weapon_data[i]['rarity'],
-                weapon_data[i]['baseAttack']
+                weapon['name'],
+                weapon_types.get_or_insert_id(weapon['type']),
+                weapon['rarity'],
+                weapon['baseAttack'],
+                row_id
             )
         )
-        conn.commit()
-        if cur.rowcount != 0:
-            count += 1
-        if count == limit:
-            break
+    conn.commit()
+
+# Get the rows in the Weapons table
+def get_stored_weapon_rows(cur):
+    """
+    Gets every row in the Weapons table by its natural key, so delta sync can match upstream records to them
+
+    ARGUMENTS:
+    cur:
+        SQLite cursor object
+
+    RETURNS:
+    rows: dict
+        Dictionary where the keys are (name, rarity) tuples and the values are row ids
+    """
+    cur.execute("SELECT name, rarity, id FROM Weapons")
+    return {(name, rarity): row_id for name, rarity, row_id in cur.fetchall()}
+
+# Delta sync
+def delta_sync_weapons(weapon_url, limit, refresh_window, cur, conn):
+    """
+    Fetches and inserts only the weapons that are not in the database yet, and refreshes the
+    most recently added ones
+
+    ARGUMENTS:
+    weapon_url: str
+        The base URL for the Genshin.dev API
+    limit: int
+        Maximum number of new weapons to insert
+    refresh_window: int
+        Number of most recently synced weapons to fetch again and update
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+
+    RETURNS:
+    Tuple (int, int):
+        Number of weapons inserted and number of weapons refreshed
+    """
+    weapon_names = get_weapon_names(weapon_url)
+    return sync_state.delta_sync(
+        resource='weapons',
+        all_keys=weapon_names,
+        fetch=lambda names, revalidate=False: iter_weapon_details(weapon_url, names, max_workers=16, adaptive=True,
+                                                                  revalidate=revalidate),
+        insert=lambda weapons: insert_weapon_data(weapons, 0, len(weapons), limit, cur, conn),
+        update=lambda rows: update_weapon_data(rows, cur, conn),
+        stored_rows=lambda: get_stored_weapon_rows(cur),
+        cur=cur,
+        conn=conn,
+        limit=limit,
+        refresh_window=refresh_window,
+        record_key=lambda weapon: (weapon['name'], weapon['rarity'])
+    )
 
 
 
@@ -199,15 +309,17 @@ def insert_weapon_data(weapon_data, start, end, limit, cur, conn):
 
 ##########################--MAIN--#################################
 
-def main():
+def main(delta=False, refresh_window=5):
     '''
     Sets up database 
     Sets up weapons tables
     Calls functions
     Inserts information into database
+
+    With delta=True, only weapons missing from the database (plus the last refresh_window ones) are fetched
     '''
     # Database setup
-    cur, conn = set_up_database("data-and-tables/genshin_impact_data.db")
+    cur, conn = database.set_up_database("data-and-tables/genshin_impact_data.db", profile=database.BULK)
     
     # Set up table
     setup_weapons_tables(cur, conn)
@@ -219,30 +331,41 @@ def main():
 
 
     ##### Weapons #####
-    weapon_data = get_weapon_data(weapon_url)
+    if delta:
+        inserted, refreshed = delta_sync_weapons(weapon_url, 25, refresh_window, cur, conn)
+        print(f"Delta sync done: {inserted} weapons added, {refreshed} refreshed.\n")
+        database.close_database(cur, conn, ['Weapons'])
+        return
+
+    # weapons are streamed: rows are inserted while the remaining weapons are still being fetched
+    weapon_data = iter_weapon_data(weapon_url, max_workers=16, timeout=10, adaptive=True)
 
     # Insert into database
     cur.execute("SELECT max(id) FROM Weapons")
     row = cur.fetchone()
     if row is None or row[0] is None:
-        insert_weapon_type_data(weapon_data, cur, conn)
         start = 0
         end = 20
     else:
         start = row[0]
         end = 187
+    try:
+        insert_weapon_data(weapon_data=weapon_data, start=start, end=end, limit=200 if start >= 95 else 25,
+                           cur=cur, conn=conn)
+    finally:
+        # stops fetching past this run's rows, so the fetch reports print here before the summary
+        weapon_data.close()
     if start >= 95:
-        insert_weapon_data(weapon_data=weapon_data, start=start, end=end, limit=200, cur=cur, conn=conn)
         print(f"All weapon data added to the database. Please move on to fill_character_table.py!\n\n\n")
+        database.close_database(cur, conn, ['Weapons'])
         quit()
 
-    insert_weapon_data(weapon_data=weapon_data, start=start, end=end, limit=25, cur=cur, conn=conn)
     cur.execute("SELECT max(id) FROM Weapons")
     row = cur.fetchone()
     print(f"{row[0] + 5} / 194 total rows of weapon data added to the database. Run the file again!\n")
 
     # Close connection
-    conn.close()
+    database.close_database(cur, conn, ['Weapons'])
 
 if __name__ == "__main__":
-    main()
+    main(delta="--delta" in sys.argv)
@@ -0,0 +1,146 @@
+import os
+import gzip
+import json
+import atexit
+import base64
+import threading
+import requests
+from response_cache import CachedResponse
+
+# Record/replay of upstream HTTP traffic for http_client
+# With GENSHIN_ARCHIVE_MODE=record, every response http_client.get hands back is appended to a gzip-compressed
+# JSON-lines archive. With GENSHIN_ARCHIVE_MODE=replay, http_client.get answers from that archive instead and never
+# touches the network, the response cache or the rate limits, so a rebuild only pays for parsing and the database.
+# Entries are keyed by the URL the fill scripts build (before GENSHIN_UPSTREAM rewriting). Unchanged responses are
+# not written again, and when a URL was archived more than once the latest entry wins.
+# A staged run only consumes its own slice of each endpoint, so in record mode the fetchers still download the rest
+# of their URL list when the run stops early, and one recorded run of each fill script archives what all its stages need
+# (media asks for the characters in the database, so record it once the characters are fully loaded)
+
+RECORD = 'record'
+REPLAY = 'replay'
+MODE = os.environ.get('GENSHIN_ARCHIVE_MODE')     # 'record', 'replay', or unset to go to the network as usual
+ARCHIVE_PATH = os.environ.get(
+    'GENSHIN_ARCHIVE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "http_archive.jsonl.gz")
+)
+KEPT_HEADERS = ['Content-Type', 'ETag', 'Last-Modified']    # the only headers worth keeping in the archive
+
+archive_file = None
+archived_entries = None
+recorded_urls = set()
+replay_entries = None
+archive_lock = threading.Lock()
+
+
+class ArchiveMissError(requests.ConnectionError):
+    """
+    Raised in replay mode for a URL that is not in the archive.
+    Subclasses requests.ConnectionError so callers that already skip failed requests skip these too
+    """
+
+
+def record(url, response):
+    """
+    Appends a response to the archive. Each URL is only written once per run, and not at all if the
+    archive already holds the same response for it
+
+    ARGUMENTS:
+    url: str
+        The requested URL
+    response: requests.Response or response_cache.CachedResponse
+        The response http_client.get returned for it
+
+    RETURNS:
+        None
+    """
+    global archive_file, archived_entries
+    entry = {
+        'url': url,
+        'status_code': response.status_code,
+        'headers': {key: response.headers[key] for key in KEPT_HEADERS if key in response.headers},
+        'encoding': response.encoding,
+    }
+    try:
+        entry['body'] = response.content.decode('utf-8')
+    except UnicodeDecodeError:
+        entry['body_b64'] = base64.b64encode(response.content).decode('ascii')
+
+    with archive_lock:
+        if url in recorded_urls:
+            return
+        recorded_urls.add(url)
+        if archived_entries is None:
+            archived_entries = load() if os.path.exists(ARCHIVE_PATH) else {}
+        if archived_entries.get(url) == entry:
+            return
+        if archive_file is None:
+            # append mode adds a new gzip member, so every fill script run extends the same archive
+            archive_file = gzip.open(ARCHIVE_PATH, 'at', encoding='utf-8')
+            atexit.register(close)
+        archive_file.write(json.dumps(entry, separators=(',', ':')) + "\n")
+
+
+def load(path=None):
+    """
+    Reads every entry from an archive
+
+    ARGUMENTS:
+    path: str
+        The archive to read. If None, ARCHIVE_PATH is used
+
+    RETURNS:
+    entries: dict
+        Dictionary where the keys are URLs and the values are the latest archived entry for each
+    """
+    entries = {}
+    with gzip.open(path or ARCHIVE_PATH, 'rt', encoding='utf-8') as f:
+        for line in f:
+            entry = json.loads(line)
+            entries[entry['url']] = entry
+    return entries
+
+
+def replay(url):
+    """
+    Serves a URL from the archive, loading the archive on first use
+
+    ARGUMENTS:
+    url: str
+        The requested URL
+
+    RETURNS:
+    response: response_cache.CachedResponse
+        The archived response. Raises ArchiveMissError if the URL was never recorded
+    """
+    global replay_entries
+    with archive_lock:
+        if replay_entries is None:
+            replay_entries = load()
+            print(f"Replaying {len(replay_entries)} archived responses from {ARCHIVE_PATH}")
+        entry = replay_entries.get(url)
+    if entry is None:
+        raise ArchiveMissError(f"{url} is not in the archive")
+
+    if 'body' in entry:
+        content = entry['body'].encode('utf-8')
+    else:
+        content = base64.b64decode(entry['body_b64'])
+    return CachedResponse(url, entry['status_code'], content, entry['headers'], entry['encoding'])
+
+
+def close():
+    """
+    Flushes and closes the archive being recorded
+
+    ARGUMENTS:
+        None
+
+    RETURNS:
+        None
+    """
+    global archive_file
+    with archive_lock:
+        if archive_file is not None:
+            archive_file.close()
+            archive_file = None
@@ -0,0 +1,489 @@
+import os
+import threading
+import itertools
+from collections import OrderedDict, deque
+import requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+import response_cache
+import rate_limiter
+import adaptive_concurrency
+import circuit_breaker
+import http_archive
+from concurrent.futures import ThreadPoolExecutor
+
+# Shared HTTP client for the fill_* scripts
+# One pooled session is reused for every request, so connections to gsi.fly.dev,
+# genshin.jmp.blue and the wiki stay open between calls instead of re-doing the TCP+TLS handshake
+
+POOL_CONNECTIONS = 4    # number of hosts to keep a connection pool for
+POOL_MAXSIZE = 32       # keep-alive connections kept open per host
+TIMEOUT = 10            # default per-request timeout in seconds
+HEADERS = {
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+}
+
+# Sends every request to this base URL instead of the real upstream hosts, e.g. http://127.0.0.1:8000
+# for load-testing/mock_upstream.py. Unset means the real APIs are used. URLs are only rewritten when the request
+# goes out, so rate limits and circuit breakers still apply per real host, as they would against the real APIs
+UPSTREAM = os.environ.get('GENSHIN_UPSTREAM')
+
+WINDOW_PER_WORKER = 2   # URLs iter_all keeps submitted per fetch thread, so it never queues the whole list at once
+MEMO_MAX_BYTES = 4 * 1024 * 1024   # body bytes of successful responses kept in memory for reuse in the same process
+MEMO_ITEM_MAX_BYTES = 64 * 1024     # larger responses (wiki pages) are not memoized, the disk cache still has them
+
+session = None
+session_lock = threading.Lock()
+
+# Single-flight state: URL -> Flight for requests in progress, plus an LRU memo of finished ones bounded by MEMO_MAX_BYTES
+flights = {}
+memo = OrderedDict()
+memo_bytes = 0
+flights_lock = threading.Lock()
+flight_stats = {'collapsed': 0, 'memo_hits': 0}
+
+
+def get_session():
+    """
+    Gets the shared requests session, creating it on first use
+
+    ARGUMENTS:
+        None
+
+    RETURNS:
+    session: requests.Session
+        Session with a keep-alive connection pool mounted for http and https
+    """
+    global session
+    with session_lock:
+        if session is None:
+            new_session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+            new_session.mount("http://", adapter)
+            new_session.mount("https://", adapter)
+            new_session.headers.update(HEADERS)
+            session = new_session
+    return session
+
+
+def resolve(url):
+    """
+    Points a URL at UPSTREAM instead of its real host when GENSHIN_UPSTREAM is set
+
+    ARGUMENTS:
+    url: str
+        The URL as the fill scripts build it, e.g. https://gsi.fly.dev/characters/1/
+
+    RETURNS:
+    url: str
+        The same path and query string on UPSTREAM, or the URL unchanged if UPSTREAM is not set
+    """
+    if not UPSTREAM:
+        return url
+    parts = urlparse(url)
+    return UPSTREAM.rstrip('/') + parts.path + (f"?{parts.query}" if parts.query else "")
+
+
+def send(url, timeout, headers=None, limiter=None):
+    """
+    Sends a GET request through the shared session, respecting the host's rate limit and circuit breaker and
+    retrying 429s, 5xx responses and connection errors with backoff
+
+    ARGUMENTS:
+    url: str
+        The URL to request
+    timeout: float
+        Per-request timeout in seconds
+    headers: dict
+        Extra request headers
+    limiter: adaptive_concurrency.AdaptiveLimiter
+        If given, every attempt takes a slot from the limiter and reports its outcome back to it
+
+    RETURNS:
+    response: requests.Response
+        The final response. Raises the last connection error if every attempt failed,
+        or circuit_breaker.CircuitOpenError if the host's circuit is open
+    """
+    # limits and breakers belong to the real host, also when the request itself goes to UPSTREAM
+    host = urlparse(url).netloc
+    breaker = circuit_breaker.get_breaker(host)
+    for attempt in range(rate_limiter.MAX_RETRIES + 1):
+        breaker.before_request()
+        rate_limiter.wait_for_token(host)
+        started = limiter.acquire() if limiter else None
+        ok = False
+        try:
+            response = get_session().get(resolve(url), timeout=timeout, headers=headers)
+            ok = response.status_code not in rate_limiter.RETRY_STATUSES
+        except (requests.ConnectionError, requests.Timeout):
+            breaker.record_failure()
+            # no point backing off and retrying once the host's circuit has opened
+            if attempt == rate_limiter.MAX_RETRIES or breaker.is_open():
+                raise
+            rate_limiter.backoff(attempt)
+            continue
+        except Exception:
+            # any other error (a bad encoding or header, too many redirects) is not retried, but still has to end
+            # the attempt on the breaker, or a half-open trial that ends this way would leave the circuit half-open
+            breaker.record_failure()
+            raise
+        finally:
+            if limiter:
+                limiter.release(started, ok)
+
+        if response.status_code in circuit_breaker.FAILURE_STATUSES:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        # a server that asks to wait longer than RETRY_AFTER_MAX gets its response handed back instead of a retry
+        if (not ok and attempt < rate_limiter.MAX_RETRIES and not breaker.is_open()
+                and rate_limiter.backoff(attempt, response.headers.get('Retry-After'))):
+            continue
+        return response
+
+
+class Flight:
+    """
+    One request in progress. Threads asking for the same URL wait on it instead of sending their own request
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+def get(url, timeout=None, use_cache=True, limiter=None, revalidate=False):
+    """
+    Sends a GET request through the shared session, going through the in-process memo, single-flight
+    de-duplication and the on-disk response cache. Records or replays the response if
+    http_archive.MODE is set
+
+    ARGUMENTS:
+    url: str
+        The URL to request
+    timeout: float
+        Per-request timeout in seconds. If None, TIMEOUT is used
+    use_cache: bool
+        Whether to serve and store the response through the memo and response_cache
+    limiter: adaptive_concurrency.AdaptiveLimiter
+        Optional adaptive concurrency limiter shared by a batch of requests
+    revalidate: bool
+        If True, the URL is checked with the server even if the memo or the cache has a fresh copy.
+        A cached copy is still revalidated with a conditional request, so an unchanged response costs a 304
+
+    RETURNS:
+    response: requests.Response or response_cache.CachedResponse
+        The response from the server, the cache or the archive
+    """
+    if http_archive.MODE == http_archive.REPLAY:
+        return http_archive.replay(url)
+    response = get_shared(url, timeout, use_cache, limiter, revalidate)
+    if http_archive.MODE == http_archive.RECORD:
+        http_archive.record(url, response)
+    return response
+
+
+def get_shared(url, timeout=None, use_cache=True, limiter=None, revalidate=False):
+    """
+    Gets a URL through the in-process memo, single-flight de-duplication and the on-disk response cache
+
+    ARGUMENTS:
+        Same as get
+
+    RETURNS:
+    response: requests.Response or response_cache.CachedResponse
+        The response from the server or the cache
+    """
+    if timeout is None:
+        timeout = TIMEOUT
+    if not use_cache:
+        return send(url, timeout, limiter=limiter)
+    if revalidate:
+        # neither the memo nor a request already in flight may answer a revalidation, and the memoized copy
+        # is dropped so later requests see the revalidated one through the cache
+        with flights_lock:
+            forget(url)
+        response = get_through_cache(url, timeout, limiter, revalidate=True)
+        response.content
+        return response
+
+    with flights_lock:
+        if url in memo:
+            memo.move_to_end(url)
+            flight_stats['memo_hits'] += 1
+            return memo[url]
+        flight = flights.get(url)
+        leader = flight is None
+        if leader:
+            flight = flights[url] = Flight()
+        else:
+            flight_stats['collapsed'] += 1
+
+    if not leader:
+        # Someone else is already fetching this URL: wait for their response and share it
+        flight.done.wait()
+        if flight.error:
+            raise flight.error
+        return flight.response
+
+    try:
+        flight.response = get_through_cache(url, timeout, limiter)
+        flight.response.content  # read the body now so every waiting thread can use it
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with flights_lock:
+            del flights[url]
+            # a response whose body could not be read is not kept, later reads of it would fail
+            if flight.error is None and flight.response.status_code == 200:
+                remember(url, flight.response)
+        flight.done.set()
+    return flight.response
+
+
+def remember(url, response):
+    """
+    Adds a response to the memo and evicts the least recently used ones until the memo fits in MEMO_MAX_BYTES.
+    Responses over MEMO_ITEM_MAX_BYTES are skipped. The caller holds flights_lock
+
+    ARGUMENTS:
+    url: str
+        The requested URL
+    response: requests.Response or response_cache.CachedResponse
+        The response, with its body already read
+
+    RETURNS:
+        None
+    """
+    global memo_bytes
+    size = len(response.content)
+    if size > MEMO_ITEM_MAX_BYTES:
+        return
+    forget(url)
+    memo[url] = response
+    memo_bytes += size
+    while memo_bytes > MEMO_MAX_BYTES:
+        _, evicted = memo.popitem(last=False)
+        memo_bytes -= len(evicted.content)
+
+
+def forget(url):
+    """
+    Removes a response from the memo, if it is there. The caller holds flights_lock
+
+    ARGUMENTS:
+    url: str
+        The requested URL
+
+    RETURNS:
+        None
+    """
+    global memo_bytes
+    response = memo.pop(url, None)
+    if response is not None:
+        memo_bytes -= len(response.content)
+
+
+def get_through_cache(url, timeout, limiter=None, revalidate=False):
+    """
+    Serves a URL from the on-disk response cache, revalidating or fetching it when needed.
+    Falls back to a stale cached copy if the host cannot be reached
+
+    ARGUMENTS:
+    url: str
+        The URL to request
+    timeout: float
+        Per-request timeout in seconds
+    limiter: adaptive_concurrency.AdaptiveLimiter
+        Optional adaptive concurrency limiter shared by a batch of requests
+    revalidate: bool
+        If True, a cached copy is revalidated even if it is still within the TTL
+
+    RETURNS:
+    response: requests.Response or response_cache.CachedResponse
+        The response from the server or the cache
+    """
+    # cached under the URL actually requested, so responses from UPSTREAM never stand in for the real APIs
+    cache_key = resolve(url)
+    entry = response_cache.lookup(cache_key)
+    if entry and entry['fresh'] and not revalidate:
+        return entry['response']
+
+    headers = response_cache.conditional_headers(entry) if entry else {}
+    try:
+        response = send(url, timeout, headers, limiter)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        # the host is down or its circuit is open: an old copy is better than nothing
+        if entry is None:
+            raise
+        print(f"Serving stale cached copy of {url} ({e.__class__.__name__})")
+        return entry['response']
+    if response.status_code in circuit_breaker.FAILURE_STATUSES and entry:
+        print(f"Serving stale cached copy of {url} (Status: {response.status_code})")
+        return entry['response']
+    if response.status_code == 304 and entry:
+        response_cache.mark_fresh(cache_key, response)
+        return entry['response']
+    if response.status_code == 200:
+        response_cache.store(cache_key, response)
+    return response
+
+
+def get_flight_stats():
+    """
+    Gets a snapshot of the de-duplication counters
+
+    ARGUMENTS:
+        None
+
+    RETURNS:
+    stats: dict
+        Copy of the counters: collapsed (requests that waited on an identical request in flight)
+        and memo_hits (requests answered from responses already fetched by this process)
+    """
+    with flights_lock:
+        return dict(flight_stats)
+
+
+def iter_all(urls, max_workers=None, timeout=None, adaptive=False, revalidate=False):
+    """
+    Generator that gets every URL in a list, optionally in parallel, yielding each response as soon as
+    it and every response before it are ready
+
+    ARGUMENTS:
+    urls: list
+        The URLs to request
+    max_workers: int
+        Number of threads fetching at once. If None, URLs are fetched one at a time
+    timeout: float
+        Per-request timeout in seconds. If None, TIMEOUT is used
+    adaptive: bool
+        If True, the number of requests in flight starts low and is adjusted by an AIMD limiter
+        (capped at max_workers) based on latency and 429/5xx/timeout responses
+    revalidate: bool
+        If True, every URL is checked with the server even if it is cached (see get)
+
+    YIELDS:
+    response: requests.Response or None
+        One response per URL, in the same order as urls. None where the request could not be completed
+    """
+    limiter = None
+    if adaptive and max_workers:
+        limiter = adaptive_concurrency.AdaptiveLimiter(max_limit=max_workers)
+
+    def fetch(url):
+        try:
+            return get(url, timeout=timeout, limiter=limiter, revalidate=revalidate)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            print(f"Failed to fetch {url}: {e.__class__.__name__}")
+            return None
+
+    urls = iter(urls)
+    executor = ThreadPoolExecutor(max_workers=max_workers) if max_workers else None
+    window = deque()
+    try:
+        if executor:
+            # only a window of URLs is submitted ahead of the consumer; each yielded response makes room for the next
+            window.extend(executor.submit(fetch, url) for url in itertools.islice(urls, max_workers * WINDOW_PER_WORKER))
+            while window:
+                response = window.popleft().result()
+                url = next(urls, None)
+                if url is not None:
+                    window.append(executor.submit(fetch, url))
+                yield response
+        else:
+            for url in urls:
+                yield fetch(url)
+    finally:
+        # also runs when the consumer closes the generator early. A recording still fetches the rest of the URLs,
+        # so the archive holds the whole endpoint set and a replay can start from any stage of a staged load.
+        # Otherwise the requests that have not started yet are dropped. Either way the report is printed
+        # from the consumer's thread
+        recording = http_archive.MODE == http_archive.RECORD
+        if executor:
+            if recording:
+                window.extend(executor.submit(fetch, url) for url in urls)
+            executor.shutdown(wait=True, cancel_futures=not recording)
+        elif recording:
+            for url in urls:
+                fetch(url)
+        if limiter:
+            print(f"Adaptive concurrency settled at {limiter.current_limit()} requests in flight")
+
+
+def fetch_all(urls, max_workers=None, timeout=None, adaptive=False):
+    """
+    Gets every URL in a list, optionally in parallel
+
+    ARGUMENTS:
+    urls: list
+        The URLs to request
+    max_workers: int
+        Number of threads fetching at once. If None, URLs are fetched one at a time
+    timeout: float
+        Per-request timeout in seconds. If None, TIMEOUT is used
+    adaptive: bool
+        If True, the number of requests in flight is adjusted by an AIMD limiter (see iter_all)
+
+    RETURNS:
+    responses: list
+        One response per URL, in the same order as urls. None where the request could not be completed
+    """
+    return list(iter_all(urls, max_workers=max_workers, timeout=timeout, adaptive=adaptive))
+
+
+def get_pages(url, page_size=25, timeout=None):
+    """
+    Gets every item from a paginated list endpoint (url?limit=&page=), one page at a time
+
+    ARGUMENTS:
+    url: str
+        The list endpoint, e.g. https://gsi.fly.dev/characters
+    page_size: int
+        Number of items requested per page
+    timeout: float
+        Per-request timeout in seconds. If None, TIMEOUT is used
+
+    RETURNS:
+    all_results: list
+        The 'results' of every page in order. Stops early at the first page that fails
+    """
+    all_results = []
+    page = 1
+    while True:
+        try:
+            response = get(f"{url}?limit={page_size}&page={page}", timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            print(f"Failed to fetch page {page} of {url}: {e.__class__.__name__}")
+            break
+        if response.status_code != 200:
+            print(f"Failed to fetch page {page} of {url}, Status: {response.status_code}")
+            break
+
+        results = response.json().get('results', [])
+        all_results.extend(results)
+
+        # Stop if there are fewer results than the limit
+        if len(results) < page_size:
+            break
+        page += 1
+    return all_results
+
+
+def close():
+    """
+    Closes the shared session and every pooled connection
+
+    ARGUMENTS:
+        None
+
+    RETURNS:
+        None
+    """
+    global session
+    with session_lock:
+        if session is not None:
+            session.close()
+            session = None
@@ -0,0 +1,87 @@
+import requests
+import http_client
+from concurrent.futures import ThreadPoolExecutor
+
+# ID-space discovery for the GSHImpact ID-range fetchers (characters/{id}/, banners/{id}/)
+# Instead of a hard-coded range, the current maximum ID is found by probing exponentially growing IDs
+# until one is missing, then narrowing the gap with a parallel (k-ary) binary search.
+# Every probe round runs `probes` requests at once, and probed URLs land in the response cache,
+# so the real fetch afterwards reuses them
+
+PROBES = 4          # requests per probe round
+START_ID = 32       # first ID probed in the exponential phase
+
+
+def id_exists(url):
+    """
+    Checks whether an ID endpoint returns a record
+
+    ARGUMENTS:
+    url: str
+        The URL of one ID, e.g. https://gsi.fly.dev/characters/12/
+
+    RETURNS:
+    exists: bool
+        True if the endpoint answered 200 with a non-empty 'result', False if it answered 404
+        or an empty 'result'. Any other answer says nothing about the ID, so connection errors
+        (including circuit_breaker.CircuitOpenError) are re-raised and other statuses raise requests.HTTPError
+    """
+    response = http_client.get(url)
+    if response.status_code == 404:
+        return False
+    if response.status_code != 200:
+        raise requests.HTTPError(f"Probe of {url} failed, Status: {response.status_code}", response=response)
+    return bool(response.json().get('result'))
+
+
+def discover_max_id(url_for_id, probes=PROBES, start_id=START_ID):
+    """
+    Finds the highest ID an endpoint currently serves, assuming IDs are handed out from 1 without gaps at the end
+
+    ARGUMENTS:
+    url_for_id: function
+        url_for_id(id) -> the URL for that ID
+    probes: int
+        Number of IDs probed at once in each round
+    start_id: int
+        First ID tried in the exponential phase
+
+    RETURNS:
+    max_id: int
+        The highest existing ID, or 0 if ID 1 does not exist.
+        Raises the probe's error, instead of guessing, if any probe fails
+    """
+    with ThreadPoolExecutor(max_workers=probes) as executor:
+        def check(ids):
+            return dict(zip(ids, executor.map(lambda i: id_exists(url_for_id(i)), ids)))
+
+        # Exponential phase: probe start_id, 2*start_id, 4*start_id, ... `probes` at a time
+        # until a missing ID bounds the range from above
+        low = 0
+        high = None
+        candidate = start_id
+        while high is None:
+            ids = [candidate * 2 ** i for i in range(probes)]
+            found = check(ids)
+            for probe_id in ids:
+                if found[probe_id]:
+                    low = probe_id
+                else:
+                    high = probe_id
+                    break
+            candidate = ids[-1] * 2
+
+        # Search phase: split (low, high) into probes + 1 parts and probe every split point at once
+        # low always exists (or is 0), high never does
+        while high - low > 1:
+            step = max(1, (high - low) // (probes + 1))
+            ids = list(range(low + step, high, step))[:probes]
+            found = check(ids)
+            for probe_id in ids:
+                if found[probe_id]:
+                    low = probe_id
+                else:
+                    high = probe_id
+                    break
+
+    return low
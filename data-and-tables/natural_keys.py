@@ -0,0 +1,44 @@
+# Natural-key uniqueness for the fact tables
+# Characters and Artifacts are keyed by name, Weapons by name and rarity (the weapons API lists two different
+# weapons as Moonpiercer) and Media by its character. A unique index on that key lets the insert_* functions upsert
+# with ON CONFLICT DO UPDATE, so writing a record again updates its row instead of appending a duplicate.
+# Banners need no extra index, their primary key is the upstream banner ID.
+# Databases filled before the keys existed can already hold duplicates, which are removed before the index is created
+
+
+def add_natural_key(table, columns, cur, conn, keep_latest=False):
+    """
+    Creates the unique index on a table's natural key if it does not exist yet, deleting duplicate rows first
+
+    ARGUMENTS:
+    table: str
+        The table, e.g. 'Weapons'
+    columns: list
+        The columns that make up the natural key
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+    keep_latest: bool
+        If True, the last written of each set of duplicates is kept. Otherwise the first is kept,
+        the row foreign keys resolved by name already point to
+
+    RETURNS:
+        None
+    """
+    index = f"idx_{table.lower()}_natural_key"
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index, ))
+    if cur.fetchone() is not None:
+        return
+
+    key = ", ".join(columns)
+    cur.execute(
+        f"""
+        DELETE FROM {table}
+        WHERE rowid NOT IN (SELECT {'max' if keep_latest else 'min'}(rowid) FROM {table} GROUP BY {key})
+        """
+    )
+    if cur.rowcount > 0:
+        print(f"Removed {cur.rowcount} duplicate rows from {table}")
+    cur.execute(f"CREATE UNIQUE INDEX {index} ON {table} ({key})")
+    conn.commit()
@@ -0,0 +1,165 @@
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+
+# Per-host token-bucket rate limiting and retry/backoff settings used by http_client
+# Each upstream host gets its own bucket, so a burst against genshin.jmp.blue does not slow down gsi.fly.dev
+
+DEFAULT_RATE = 10.0     # requests per second allowed per host
+DEFAULT_BURST = 10      # requests that can go out back to back before the rate applies
+HOST_LIMITS = {         # per-host overrides: host -> (rate, burst)
+    'gsi.fly.dev': (10.0, 10),
+    'genshin.jmp.blue': (20.0, 20),
+    'genshin-impact.fandom.com': (2.0, 2),
+}
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5      # seconds before the first retry, doubled on every attempt
+BACKOFF_MAX = 30.0      # longest single exponential backoff wait between retries
+RETRY_AFTER_MAX = 300.0     # longest Retry-After honoured; a server asking for more gets no retry
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+buckets = {}
+buckets_lock = threading.Lock()
+stats = {'requests': 0, 'retries': 0, 'throttled_seconds': 0.0, 'backoff_seconds': 0.0}
+stats_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. acquire() blocks until a token is available
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes one token from the bucket, sleeping until one is available
+
+        ARGUMENTS:
+            None
+
+        RETURNS:
+        waited: float
+            Seconds spent waiting for the token
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+def get_bucket(host):
+    """
+    Gets the token bucket for a host, creating it on first use
+
+    ARGUMENTS:
+    host: str
+        The host name, e.g. gsi.fly.dev
+
+    RETURNS:
+    bucket: TokenBucket
+        The bucket shared by every request to that host
+    """
+    with buckets_lock:
+        if host not in buckets:
+            rate, burst = HOST_LIMITS.get(host, (DEFAULT_RATE, DEFAULT_BURST))
+            buckets[host] = TokenBucket(rate, burst)
+        return buckets[host]
+
+
+def wait_for_token(host):
+    """
+    Blocks until the host's rate limit allows another request and records the time spent waiting
+
+    ARGUMENTS:
+    host: str
+        The host name
+
+    RETURNS:
+        None
+    """
+    waited = get_bucket(host).acquire()
+    with stats_lock:
+        stats['requests'] += 1
+        stats['throttled_seconds'] += waited
+
+
+def parse_retry_after(value):
+    """
+    Parses a Retry-After header, which is either a number of seconds or an HTTP date
+
+    ARGUMENTS:
+    value: str
+        The header value, or None
+
+    RETURNS:
+    seconds: float or None
+        Seconds to wait, or None if the header is missing or unreadable
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt, retry_after=None):
+    """
+    Sleeps before a retry and records it. Uses Retry-After as given when the server sent one,
+    otherwise exponential backoff with full jitter, capped at BACKOFF_MAX
+
+    ARGUMENTS:
+    attempt: int
+        Number of the attempt that just failed, starting at 0
+    retry_after: str
+        The response's Retry-After header, if any
+
+    RETURNS:
+    retry: bool
+        True after sleeping, False without sleeping if Retry-After is longer than RETRY_AFTER_MAX,
+        in which case the request should not be retried
+    """
+    delay = parse_retry_after(retry_after)
+    if delay is None:
+        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    elif delay > RETRY_AFTER_MAX:
+        return False
+    with stats_lock:
+        stats['retries'] += 1
+        stats['backoff_seconds'] += delay
+    time.sleep(delay)
+    return True
+
+
+def get_stats():
+    """
+    Gets a snapshot of the request, retry and throttling counters
+
+    ARGUMENTS:
+        None
+
+    RETURNS:
+    stats: dict
+        Copy of the counters: requests, retries, throttled_seconds, backoff_seconds
+    """
+    with stats_lock:
+        return dict(stats)
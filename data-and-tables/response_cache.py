@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# Disk-backed HTTP response cache shared by the fill_* scripts (replaces the old JSON-file cache in -old/)
+# Responses are stored in a small SQLite database keyed by URL. Entries younger than TTL are served
+# straight from disk, older entries are revalidated with If-None-Match / If-Modified-Since, and the
+# least recently used entries are evicted once the cache grows past MAX_SIZE bytes.
+# Load-test runs can keep the cache out of the way with GENSHIN_HTTP_CACHE: 'off' neither reads nor writes it,
+# so every request goes to the upstream, and 'clear' empties it once when it is first opened
+
+OFF = 'off'
+CLEAR = 'clear'
+MODE = os.environ.get('GENSHIN_HTTP_CACHE')      # 'off', 'clear', or unset to use the cache as usual
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "http_cache.db")
+TTL = 24 * 60 * 60              # seconds before an entry has to be revalidated
+MAX_SIZE = 64 * 1024 * 1024     # total body bytes kept on disk
+
+cache_conn = None
+cache_lock = threading.Lock()
+
+
+class CachedResponse:
+    """
+    Response served from the cache. Has the parts of requests.Response the fill scripts use
+    """
+    def __init__(self, url, status_code, content, headers, encoding):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.encoding = encoding
+        self.from_cache = True
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def get_connection():
+    """
+    Opens the cache database on first use and creates the Responses table
+
+    ARGUMENTS:
+        None
+
+    RETURNS:
+    cache_conn: sqlite3.Connection
+        Connection to the cache database
+    """
+    global cache_conn
+    if cache_conn is None:
+        cache_conn = sqlite3.connect(CACHE_PATH, check_same_thread=False)
+        cache_conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS Responses (
+                url TEXT PRIMARY KEY,
+                status_code INTEGER NOT NULL,
+                body BLOB NOT NULL,
+                headers TEXT NOT NULL,
+                encoding TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+            """
+        )
+        if MODE == CLEAR:
+            cache_conn.execute("DELETE FROM Responses")
+        cache_conn.commit()
+    return cache_conn
+
+
+def lookup(url):
+    """
+    Looks up a cached response for a URL
+
+    ARGUMENTS:
+    url: str
+        The requested URL
+
+    RETURNS:
+    entry: dict or None
+        The cached response, its validators and whether it is still within the TTL,
+        or None if the URL is not cached or MODE is 'off'
+    """
+    if MODE == OFF:
+        return None
+    with cache_lock:
+        conn = get_connection()
+        row = conn.execute(
+            "SELECT status_code, body, headers, encoding, etag, last_modified, fetched_at FROM Responses WHERE url = ?",
+            (url, )
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE Responses SET last_used = ? WHERE url = ?", (time.time(), url))
+        conn.commit()
+
+    response = CachedResponse(url, row[0], row[1], json.loads(row[2]), row[3])
+    return {
+        'response': response,
+        'etag': row[4],
+        'last_modified': row[5],
+        'fresh': time.time() - row[6] < TTL,
+    }
+
+
+def conditional_headers(entry):
+    """
+    Builds the revalidation headers for a stale cache entry
+
+    ARGUMENTS:
+    entry: dict
+        Cache entry returned from lookup
+
+    RETURNS:
+    headers: dict
+        If-None-Match / If-Modified-Since headers for the entry's validators
+    """
+    headers = {}
+    if entry['etag']:
+        headers['If-None-Match'] = entry['etag']
+    if entry['last_modified']:
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+
+def store(url, response):
+    """
+    Stores a successful response in the cache and evicts old entries if the cache is over MAX_SIZE
+
+    ARGUMENTS:
+    url: str
+        The requested URL
+    response: requests.Response
+        The response to store
+
+    RETURNS:
+        None
+    """
+    if MODE == OFF:
+        return
+    now = time.time()
+    body = response.content
+    headers = {key: value for key, value in response.headers.items() if key.lower() != 'content-encoding'}
+    with cache_lock:
+        conn = get_connection()
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO Responses
+            (url, status_code, body, headers, encoding, etag, last_modified, fetched_at, last_used, size)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                url,
+                response.status_code,
+                body,
+                json.dumps(headers),
+                response.encoding,
+                response.headers.get('ETag'),
+                response.headers.get('Last-Modified'),
+                now,
+                now,
+                len(body)
+            )
+        )
+        evict(conn)
+        conn.commit()
+
+
+def mark_fresh(url, response):
+    """
+    Resets the TTL of a cache entry after the server answered 304 Not Modified, and takes over
+    any validators the 304 carries, so the next revalidation sends the server's current ones
+
+    ARGUMENTS:
+    url: str
+        The requested URL
+    response: requests.Response
+        The 304 response
+
+    RETURNS:
+        None
+    """
+    now = time.time()
+    with cache_lock:
+        conn = get_connection()
+        conn.execute(
+            """
+            UPDATE Responses
+            SET fetched_at = ?, last_used = ?, etag = coalesce(?, etag), last_modified = coalesce(?, last_modified)
+            WHERE url = ?
+            """,
+            (now, now, response.headers.get('ETag'), response.headers.get('Last-Modified'), url)
+        )
+        conn.commit()
+
+
+def evict(conn):
+    """
+    Deletes the least recently used entries until the cache fits in MAX_SIZE
+
+    ARGUMENTS:
+    conn:
+        Connection to the cache database
+
+    RETURNS:
+        None
+    """
+    total = conn.execute("SELECT coalesce(sum(size), 0) FROM Responses").fetchone()[0]
+    if total <= MAX_SIZE:
+        return
+    for url, size in conn.execute("SELECT url, size FROM Responses ORDER BY last_used ASC").fetchall():
+        conn.execute("DELETE FROM Responses WHERE url = ?", (url, ))
+        total -= size
+        if total <= MAX_SIZE:
+            break
+
+
+def clear():
+    """
+    Deletes every cached response
+
+    ARGUMENTS:
+        None
+
+    RETURNS:
+        None
+    """
+    with cache_lock:
+        conn = get_connection()
+        conn.execute("DELETE FROM Responses")
+        conn.commit()
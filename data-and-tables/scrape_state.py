@@ -0,0 +1,153 @@
+import re
+import json
+import hashlib
+
+# Change detection for scraped wiki pages
+# The ScrapedPages table keeps, per URL, a fingerprint of the last fetched page (the wiki revision ID, or a hash of
+# the HTML if the page has none) together with the rows parsed from it, and the fingerprint of the last copy whose
+# rows were all written to the database. A run that sees the same fingerprint again can reuse the parsed rows
+# instead of parsing the page, and skip inserting altogether if that copy is already fully stored.
+# Fingerprints start with FORMAT_VERSION, so rows saved in an older shape never match and the page is parsed again
+
+REVISION_PATTERN = re.compile(r'"wgRevisionId":(\d+)')
+FORMAT_VERSION = 2      # bump whenever the shape of the saved rows changes (v2: artifact sets with their pieces)
+
+
+def setup_scraped_pages_table(cur, conn):
+    """
+    Sets up the ScrapedPages table
+
+    ARGUMENTS:
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+
+    RETURNS:
+        None
+    """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ScrapedPages (
+            url TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            rows TEXT NOT NULL,
+            stored_fingerprint TEXT
+        )
+        """
+    )
+    conn.commit()
+
+
+def page_fingerprint(html):
+    """
+    Fingerprints a wiki page. The revision ID only changes when the page is edited, unlike the HTML,
+    which also carries per-request tokens and timestamps
+
+    ARGUMENTS:
+    html: str
+        The page's HTML
+
+    RETURNS:
+    fingerprint: str
+        'v<FORMAT_VERSION>:rev:<revision ID>' if the page has one, otherwise 'v<FORMAT_VERSION>:sha256:<hash of the HTML>'
+    """
+    match = REVISION_PATTERN.search(html)
+    if match:
+        return f"v{FORMAT_VERSION}:rev:{match.group(1)}"
+    return f"v{FORMAT_VERSION}:sha256:" + hashlib.sha256(html.encode("utf-8")).hexdigest()
+
+
+def get_scraped_page(url, cur, conn):
+    """
+    Gets what is remembered about a page
+
+    ARGUMENTS:
+    url: str
+        The page URL
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+
+    RETURNS:
+    page: dict or None
+        Dictionary with the page's 'fingerprint', parsed 'rows' and 'stored_fingerprint', or None if it was never scraped
+    """
+    setup_scraped_pages_table(cur, conn)
+    cur.execute("SELECT fingerprint, rows, stored_fingerprint FROM ScrapedPages WHERE url = ?", (url, ))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return {'fingerprint': row[0], 'rows': json.loads(row[1]), 'stored_fingerprint': row[2]}
+
+
+def save_scraped_page(url, fingerprint, rows, cur, conn):
+    """
+    Remembers the fingerprint of a freshly parsed page and the rows parsed from it
+
+    ARGUMENTS:
+    url: str
+        The page URL
+    fingerprint: str
+        Value returned from page_fingerprint
+    rows: list
+        The rows parsed from the page (anything json.dumps accepts)
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+
+    RETURNS:
+        None
+    """
+    setup_scraped_pages_table(cur, conn)
+    cur.execute(
+        """
+        INSERT INTO ScrapedPages (url, fingerprint, rows) VALUES (?, ?, ?)
+        ON CONFLICT (url) DO UPDATE SET fingerprint = excluded.fingerprint, rows = excluded.rows
+        """,
+        (url, fingerprint, json.dumps(rows))
+    )
+    conn.commit()
+
+
+def mark_page_stored(url, fingerprint, cur, conn):
+    """
+    Records that every row parsed from this copy of the page is in the database
+
+    ARGUMENTS:
+    url: str
+        The page URL
+    fingerprint: str
+        Fingerprint of the copy that was stored
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+
+    RETURNS:
+        None
+    """
+    setup_scraped_pages_table(cur, conn)
+    cur.execute("UPDATE ScrapedPages SET stored_fingerprint = ? WHERE url = ?", (fingerprint, url))
+    conn.commit()
+
+
+def get_stored_urls(cur, conn):
+    """
+    Gets every page whose rows have been fully stored, so an interrupted scrape can skip them
+
+    ARGUMENTS:
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+
+    RETURNS:
+    urls: set
+        URLs with a stored_fingerprint
+    """
+    setup_scraped_pages_table(cur, conn)
+    cur.execute("SELECT url FROM ScrapedPages WHERE stored_fingerprint IS NOT NULL")
+    return {row[0] for row in cur.fetchall()}
@@ -0,0 +1,199 @@
+# Delta sync for the fill_* scripts
+# A delta run only fetches the upstream keys that are not stored yet, plus the last `refresh_window` stored keys so
+# recently added content gets re-checked, instead of the whole upstream set. Keys are matched to rows by the table's
+# natural key (see natural_keys.py), never by row order. Where the upstream key is the natural key (artifact names,
+# banner IDs, character IDs in Media) that match is read straight from the table. Where it is not (weapon slugs and
+# character IDs, stored by name), the SyncedKeys table remembers which row each key's record went into
+
+
+def setup_sync_table(cur, conn):
+    """
+    Sets up the SyncedKeys table
+
+    ARGUMENTS:
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+
+    RETURNS:
+        None
+    """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS SyncedKeys (
+            resource TEXT NOT NULL,
+            key TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            PRIMARY KEY (resource, key)
+        )
+        """
+    )
+    conn.commit()
+
+
+def get_synced_keys(resource, all_keys, stored, cur, conn, fetch=None, record_key=None):
+    """
+    Gets the keys already stored for a resource, mapped to the row they were stored in.
+    If SyncedKeys has nothing for a resource whose rows were loaded before delta sync was used,
+    every key's record is fetched once and matched to the stored rows by natural key
+
+    ARGUMENTS:
+    resource: str
+        Name of the resource, e.g. 'weapons'
+    all_keys: list
+        Every upstream key, in upstream order
+    stored: dict
+        Every stored row, where the keys are natural keys and the values are row ids
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+    fetch: function
+        fetch(keys) -> iterable with one record (or None if the request failed) per key, in order.
+        Only needed when record_key is given
+    record_key: function
+        record_key(record) -> the record's natural key. If None, the upstream keys are the natural keys
+
+    RETURNS:
+    synced: dict
+        Dictionary where the keys are upstream keys (as str) and the values are row ids
+    """
+    if record_key is None:
+        return {str(key): stored[key] for key in all_keys if key in stored}
+
+    setup_sync_table(cur, conn)
+    cur.execute("SELECT key, row_id FROM SyncedKeys WHERE resource = ?", (resource, ))
+    synced = dict(cur.fetchall())
+    if not synced and stored:
+        print(f"Delta sync: matching every upstream {resource} record to the {len(stored)} rows already stored...")
+        for key, record in zip(all_keys, fetch(all_keys)):
+            if record is not None and record_key(record) in stored:
+                synced[str(key)] = stored[record_key(record)]
+        record_synced_keys(resource, synced, cur, conn)
+    return synced
+
+
+def record_synced_keys(resource, synced, cur, conn):
+    """
+    Records that keys have been stored
+
+    ARGUMENTS:
+    resource: str
+        Name of the resource, e.g. 'weapons'
+    synced: dict
+        Dictionary of upstream key -> row id
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+
+    RETURNS:
+        None
+    """
+    cur.executemany(
+        "INSERT OR REPLACE INTO SyncedKeys (resource, key, row_id) VALUES (?, ?, ?)",
+        [(resource, str(key), row_id) for key, row_id in synced.items()]
+    )
+    conn.commit()
+
+
+def select_delta_keys(all_keys, synced, limit, refresh_window):
+    """
+    Picks the keys a delta run has to fetch
+
+    ARGUMENTS:
+    all_keys: list
+        Every upstream key, in upstream order
+    synced: dict
+        Keys already stored, returned from get_synced_keys
+    limit: int
+        Maximum number of new keys to pick
+    refresh_window: int
+        Number of most recently synced keys to fetch again
+
+    RETURNS:
+    Tuple (list, list):
+        The new keys and the keys to refresh, both in upstream order
+    """
+    new_keys = [key for key in all_keys if str(key) not in synced][:limit]
+    stored_keys = [key for key in all_keys if str(key) in synced]
+    refresh_keys = stored_keys[-refresh_window:] if refresh_window > 0 else []
+    return new_keys, refresh_keys
+
+
+def delta_sync(resource, all_keys, fetch, insert, update, stored_rows, cur, conn, limit=25, refresh_window=5,
+               record_key=None):
+    """
+    Runs a delta sync for one resource: fetches only the missing keys and the refresh window,
+    inserts the new records and updates the refreshed rows in place
+
+    ARGUMENTS:
+    resource: str
+        Name of the resource, e.g. 'weapons'
+    all_keys: list
+        Every upstream key, in upstream order
+    fetch: function
+        fetch(keys, revalidate=False) -> iterable with one record (or None if the request failed) per key, in order.
+        With revalidate=True the records have to be checked with the upstream rather than served from the cache
+    insert: function
+        insert(records) inserts a list of new records, one row each, in order
+    update: function
+        update(rows) updates existing rows from a list of (row_id, record) tuples
+    stored_rows: function
+        stored_rows() -> dictionary of every stored row, where the keys are natural keys and the values are row ids
+    cur:
+        SQLite cursor object
+    conn:
+        SQLite connection object
+    limit: int
+        Maximum number of new rows to insert
+    refresh_window: int
+        Number of most recently synced keys to fetch again
+    record_key: function
+        record_key(record) -> the record's natural key. If None, the upstream keys are the natural keys
+
+    RETURNS:
+    Tuple (int, int):
+        Number of rows inserted and number of rows refreshed
+    """
+    stored = stored_rows()
+    synced = get_synced_keys(resource, all_keys, stored, cur, conn, fetch, record_key)
+    new_keys, refresh_keys = select_delta_keys(all_keys, synced, limit, refresh_window)
+    print(f"Delta sync: fetching {len(new_keys)} new and {len(refresh_keys)} refreshed {resource}...")
+
+    def natural_key(key, record):
+        return key if record_key is None else record_key(record)
+
+    new_records = []
+    new_fetched_keys = []
+    refreshed_rows = []
+    matched = {}
+    # the refreshed records are revalidated, a cached copy younger than the cache TTL would make the refresh a no-op
+    fetched = list(zip(new_keys, fetch(new_keys))) + list(zip(refresh_keys, fetch(refresh_keys, revalidate=True)))
+    for key, record in fetched:
+        if record is None:
+            continue
+        row_id = stored.get(natural_key(key, record))
+        if str(key) in synced:
+            # Trust the natural key over the remembered row, which is only used if the record was renamed upstream
+            row_id = row_id if row_id is not None else synced[str(key)]
+            refreshed_rows.append((row_id, record))
+            matched[str(key)] = row_id
+        elif row_id is not None:
+            # Already stored, by a staged run since the last delta run or under another upstream key
+            # (the weapons API lists some weapons twice)
+            matched[str(key)] = row_id
+        else:
+            new_fetched_keys.append(key)
+            new_records.append(record)
+
+    insert(new_records)
+    update(refreshed_rows)
+    stored = stored_rows()
+    for key, record in zip(new_fetched_keys, new_records):
+        if natural_key(key, record) in stored:
+            matched[str(key)] = stored[natural_key(key, record)]
+    if record_key is not None:
+        record_synced_keys(resource, matched, cur, conn)
+    return len(new_records), len(refreshed_rows)
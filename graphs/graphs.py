@@ -1,6 +1,10 @@
 import matplotlib.pyplot as plt
-import sqlite3
 import os
+import sys
+
+# The shared connection profiles live in data-and-tables/database.py, next to the fill scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data-and-tables"))
+import database
 
 def get_weapon_stats(cur):
     '''
@@ -304,8 +308,7 @@ def main():
     root_dir = os.path.abspath(os.path.join(current_dir, "..")) 
     db_path = os.path.join(root_dir, 'data-and-tables/genshin_impact_data.db')
     
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
+    cur, conn = database.set_up_database(db_path, profile=database.READONLY)
 
     # call the functions to gather the needed information from the database 
     weapons_info = get_weapon_stats(cur)
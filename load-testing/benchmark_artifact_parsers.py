@@ -0,0 +1,276 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import platform
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from bs4 import BeautifulSoup, FeatureNotFound
+
+try:
+    import resource
+except ImportError:     # not available on Windows, peak RSS is reported as None there
+    resource = None
+
+# Benchmark suite for the artifact scraper's parsing logic (fill_artifact_table.parse_artifact_page)
+# Every parser backend and parse scope is run on the saved Artifact/Sets page and on synthetically enlarged copies
+# of it (the table rows repeated), each in its own fresh process so peak RSS belongs to that run alone.
+# Parse time, rows per second and peak RSS are printed and saved as JSON, and can be compared with an earlier run:
+#   python load-testing/benchmark_artifact_parsers.py --sizes 1,10,100 --output before.json
+#   python load-testing/benchmark_artifact_parsers.py --sizes 1,10,100 --compare before.json
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "data-and-tables"))
+import fill_artifact_table
+
+ARTIFACT_HTML = os.path.join(REPO_DIR, "-old", "APIs-and-scraping",
+                             "view-source_https___genshin-impact.fandom.com_wiki_Artifact_Sets.html")
+RESULTS_DIR = os.path.join(REPO_DIR, "load-testing", "results")
+SIZES = [1, 10, 100]    # how many copies of the table rows the benchmarked pages have
+REPEAT = 3              # timed parses per run
+REGRESSION_THRESHOLD = 0.10     # --compare flags runs that got this much slower or bigger
+
+
+def available_parsers():
+    """
+    Gets the parser backends from fill_artifact_table.HTML_PARSERS that are installed
+
+    ARGUMENTS:
+        None
+
+    RETURNS:
+    parsers: list
+        Names of the installed backends
+    """
+    parsers = []
+    for parser in fill_artifact_table.HTML_PARSERS:
+        try:
+            BeautifulSoup("", parser)
+        except FeatureNotFound:
+            print(f"Skipping {parser}: not installed")
+            continue
+        parsers.append(parser)
+    return parsers
+
+
+def enlarge_page(html, size):
+    """
+    Makes a bigger copy of the Artifact/Sets page by repeating the artifact table's rows
+
+    ARGUMENTS:
+    html: str
+        The page's HTML
+    size: int
+        Number of copies of the table rows
+
+    RETURNS:
+    html: str
+        The page with the rows after the table's header row repeated size times
+    """
+    if size == 1:
+        return html
+    table_start = fill_artifact_table.WIKITABLE_PATTERN.search(html).start()
+    rows_start = html.index("</tr>", table_start) + len("</tr>")
+    rows_end = html.index("</table>", rows_start)
+    tbody_end = html.rfind("</tbody>", rows_start, rows_end)
+    if tbody_end != -1:
+        rows_end = tbody_end
+    return html[:rows_start] + html[rows_start:rows_end] * size + html[rows_end:]
+
+
+def peak_rss_kb():
+    """
+    Gets the peak resident set size of this process so far
+
+    ARGUMENTS:
+        None
+
+    RETURNS:
+    peak: int or None
+        Peak RSS in KB, or None where the resource module is not available
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak   # macOS reports bytes, Linux KB
+
+
+def run_benchmark(html_path, size, parser, scope, repeat):
+    """
+    Times parse_artifact_page on one page size with one backend and scope. Meant to run in a fresh process
+
+    ARGUMENTS:
+    html_path: str
+        The saved Artifact/Sets page
+    size: int
+        Number of copies of the table rows, see enlarge_page
+    parser: str
+        BeautifulSoup parser backend
+    scope: str
+        Parse scope, one of fill_artifact_table.SCOPES
+    repeat: int
+        Number of timed parses
+
+    RETURNS:
+    result: dict
+        Timings, rows per second, RSS before and at the peak of parsing, and a hash of the parsed rows
+    """
+    with open(html_path, encoding="utf-8") as f:
+        html = enlarge_page(f.read(), size)
+    baseline_rss = peak_rss_kb()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = list(fill_artifact_table.parse_artifact_page(html, parser, scope))
+        times.append(time.perf_counter() - start)
+    peak_rss = peak_rss_kb()
+
+    return {
+        'size': size,
+        'backend': 'event-based' if scope == 'stream' else parser,
+        'scope': scope,
+        'page_bytes': len(html.encode("utf-8")),
+        'rows': len(rows),
+        'best_seconds': min(times),
+        'mean_seconds': sum(times) / len(times),
+        'rows_per_second': len(rows) / min(times),
+        'baseline_rss_kb': baseline_rss,
+        'peak_rss_kb': peak_rss,
+        'parse_rss_kb': peak_rss - baseline_rss if peak_rss is not None else None,
+        'rows_hash': hashlib.sha256(json.dumps(rows).encode("utf-8")).hexdigest(),
+    }
+
+
+def run_suite(html_path, sizes, repeat):
+    """
+    Runs every backend and scope on every page size, each in a new process
+
+    ARGUMENTS:
+    html_path: str
+        The saved Artifact/Sets page
+    sizes: list
+        Page sizes to benchmark, see enlarge_page
+    repeat: int
+        Number of timed parses per run
+
+    RETURNS:
+    results: list
+        One result per run, returned from run_benchmark, with 'matches_reference' set to whether its rows
+        are identical to the first run of the same size
+    """
+    # The stream scope uses its own event-based parser, so it only runs once per size
+    backends = available_parsers()
+    runs = [(backend, scope) for scope in fill_artifact_table.SCOPES if scope != 'stream' for backend in backends]
+    runs.append(('html.parser', 'stream'))
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for size in sizes:
+        reference_hash = None
+        for parser, scope in runs:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = pool.submit(run_benchmark, html_path, size, parser, scope, repeat).result()
+            if reference_hash is None:
+                reference_hash = result['rows_hash']
+            result['matches_reference'] = result['rows_hash'] == reference_hash
+            results.append(result)
+            print_result(result)
+    return results
+
+
+def print_result(result):
+    """
+    Prints one benchmark result as a table row
+
+    ARGUMENTS:
+    result: dict
+        Result returned from run_benchmark
+
+    RETURNS:
+        None
+    """
+    label = f"{result['backend']} / {result['scope']}"
+    rss = "peak RSS n/a"
+    if result['peak_rss_kb'] is not None:
+        rss = f"peak RSS {result['peak_rss_kb'] / 1024:7.1f} MB ({result['parse_rss_kb'] / 1024:+.1f} MB parsing)"
+    warning = "" if result['matches_reference'] else "   OUTPUT DIFFERS"
+    print(f"{result['size']:>4}x  {label:<24} {result['best_seconds'] * 1000:9.1f} ms  "
+          f"{result['rows_per_second']:10.0f} rows/s  {rss}{warning}")
+
+
+def compare_results(results, baseline_results):
+    """
+    Prints how every run changed compared to an earlier saved run
+
+    ARGUMENTS:
+    results: list
+        Results of this run
+    baseline_results: list
+        Results loaded from an earlier JSON file
+
+    RETURNS:
+    regressions: int
+        Number of runs that got more than REGRESSION_THRESHOLD slower or bigger
+    """
+    baseline = {(result['size'], result['backend'], result['scope']): result for result in baseline_results}
+    regressions = 0
+    print("\nCompared to the baseline:")
+    for result in results:
+        before = baseline.get((result['size'], result['backend'], result['scope']))
+        if before is None:
+            continue
+        time_change = result['best_seconds'] / before['best_seconds'] - 1
+        rss_change = None
+        if result['peak_rss_kb'] and before.get('peak_rss_kb'):
+            rss_change = result['peak_rss_kb'] / before['peak_rss_kb'] - 1
+        regressed = time_change > REGRESSION_THRESHOLD or (rss_change or 0) > REGRESSION_THRESHOLD
+        regressions += regressed
+        rss_text = f"{rss_change:+7.1%}" if rss_change is not None else "    n/a"
+        print(f"{result['size']:>4}x  {result['backend'] + ' / ' + result['scope']:<24} time {time_change:+7.1%}  "
+              f"rss {rss_text}{'   REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the artifact page parser backends and scopes")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="comma-separated page sizes, e.g. 1,10,100")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="timed parses per run")
+    parser.add_argument("--html", default=ARTIFACT_HTML, help="saved Artifact/Sets page to parse")
+    parser.add_argument("--output", help="JSON file to save the results to (default: a timestamped file in results/)")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    print(f"Benchmarking {args.html} at {', '.join(f'{size}x' for size in sizes)}, best of {args.repeat}\n")
+    results = run_suite(args.html, sizes, args.repeat)
+
+    report = {
+        'created': datetime.now().isoformat(timespec="seconds"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'html': os.path.relpath(args.html, REPO_DIR),
+        'repeat': args.repeat,
+        'results': results,
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"artifact_parsers_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print(f"\nResults saved to {output}")
+
+    if not all(result['matches_reference'] for result in results):
+        print("WARNING: some backends or scopes produced different rows")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare_results(results, json.load(f)['results'])
+        print(f"{regressions} regression(s) over {REGRESSION_THRESHOLD:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from html import escape
+from urllib.parse import urlparse, parse_qs, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Local stand-in for gsi.fly.dev, genshin.jmp.blue and the fandom wiki, for reproducible ingestion load tests
+# Serves the JSON dumps in -old/JSON-and-old-cache-method/, the saved Artifact/Sets page and generated artifact piece
+# pages, with configurable latency, error rate and payload size. The three upstreams use different paths, so one
+# server stands in for all of them: start it, then run a fill script with GENSHIN_UPSTREAM set, e.g.
+#   python load-testing/mock_upstream.py --latency 0.05 --error-rate 0.1
+#   GENSHIN_UPSTREAM=http://127.0.0.1:8000 python data-and-tables/fill_weapon_table.py
+# Add GENSHIN_HTTP_CACHE=off to send every request to the mock instead of answering repeats from http_cache.db
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(REPO_DIR, "-old", "JSON-and-old-cache-method")
+ARTIFACT_HTML = os.path.join(REPO_DIR, "-old", "APIs-and-scraping",
+                             "view-source_https___genshin-impact.fandom.com_wiki_Artifact_Sets.html")
+
+HOST = "127.0.0.1"
+PORT = 8000
+LATENCY = 0.0               # seconds added to every response
+JITTER = 0.0                # extra random latency, uniform between 0 and this many seconds
+ERROR_RATE = 0.0            # fraction of requests answered with one of ERROR_STATUSES instead
+ERROR_STATUSES = (429, 503)
+PAD_BYTES = 0               # filler bytes added to every JSON record, to test bigger payloads
+SEED = 206                  # seed for latency jitter and error injection, so runs are repeatable
+DUPLICATE_WEAPONS = ['blackcliff-agate']   # listed in the real weapons/ index but without a detail page
+MEDIA_TYPES = ['promotion', 'holiday', 'birthday', 'videos', 'cameos', 'artwork']
+
+
+def load_data():
+    """
+    Loads the JSON dumps and the saved Artifact/Sets page
+
+    ARGUMENTS:
+        None
+
+    RETURNS:
+    data: dict
+        Dictionary with 'characters' and 'banners' (ID -> object), 'weapons' (weapon ID -> object),
+        'artifact_html' (bytes) and 'artifact_pieces' (wiki path -> piece from the artifact dump)
+    """
+    def load(file_name):
+        with open(os.path.join(DATA_DIR, file_name), encoding="utf-8") as f:
+            return json.load(f)
+
+    with open(ARTIFACT_HTML, "rb") as f:
+        artifact_html = f.read()
+
+    return {
+        'characters': {character['id']: character for character in load("character-data.json")},
+        'banners': {banner['id']: banner for banner in load("banner-data.json")},
+        'weapons': {weapon['id']: weapon for weapon in load("weapon-data.json")},
+        'artifact_html': artifact_html,
+        'artifact_pieces': {unquote(urlparse(piece['artifactURL']).path): piece for piece in load("artifact-data.json")},
+    }
+
+
+def make_media(character):
+    """
+    Builds a media object for a character. There is no media dump, so the counts are made up
+    but always the same for the same character ID
+
+    ARGUMENTS:
+    character: dict
+        A character object from the character dump
+
+    RETURNS:
+    media: dict
+        Object shaped like the 'result' of characters/{id}/media
+    """
+    media = {'character': {'id': character['id'], 'name': character['name']}}
+    for i, media_type in enumerate(MEDIA_TYPES):
+        count = (character['id'] * (i + 3)) % 7
+        media[media_type] = [
+            {'name': f"{character['name']} {media_type} {n + 1}", 'url': f"/media/{character['id']}/{media_type}/{n + 1}"}
+            for n in range(count)
+        ]
+    return media
+
+
+def make_piece_page(piece, pad_bytes):
+    """
+    Builds a wiki page for an artifact piece, with a portable infobox like the real piece pages
+
+    ARGUMENTS:
+    piece: dict
+        A piece from the artifact dump
+    pad_bytes: int
+        Filler bytes added to the page body
+
+    RETURNS:
+    html: bytes
+        The page
+    """
+    fields = [
+        ('set', piece['artifactSetName']),
+        ('quality', f"{piece['maxSetQuality']}★"),
+        ('pieces', str(piece['setNumPieces'])),
+    ] + [(f"{bonus['pieces']}pc", bonus['bonus']) for bonus in piece['setBonuses']]
+    items = "".join(
+        f'<div class="pi-item pi-data" data-source="{field}"><h3 class="pi-data-label">{field}</h3>'
+        f'<div class="pi-data-value">{escape(value)}</div></div>'
+        for field, value in fields
+    )
+    return (
+        f'<!DOCTYPE html><html><head><title>{escape(piece["name"])} | Genshin Impact Wiki</title></head><body>'
+        f'<aside class="portable-infobox"><h2 class="pi-item pi-title" data-source="title">{escape(piece["name"])}</h2>'
+        f'{items}</aside><p>{"x" * pad_bytes}</p></body></html>'
+    ).encode("utf-8")
+
+
+def pad(record, pad_bytes):
+    """
+    Adds filler to a JSON record so responses can be made bigger without changing the parsed fields
+
+    ARGUMENTS:
+    record: dict
+        The record to pad
+    pad_bytes: int
+        Number of filler characters to add
+
+    RETURNS:
+    record: dict
+        A copy of the record with a 'padding' field, or the record itself if pad_bytes is 0
+    """
+    if not pad_bytes:
+        return record
+    return {**record, 'padding': "x" * pad_bytes}
+
+
+def route(path, data, pad_bytes=PAD_BYTES):
+    """
+    Works out the response for a request path
+
+    ARGUMENTS:
+    path: str
+        The request path and query string, e.g. /characters?limit=25&page=2
+    data: dict
+        Data returned from load_data
+    pad_bytes: int
+        Filler bytes added to every JSON record
+
+    RETURNS:
+    Tuple (int, str, object):
+        Status code, content type, and the body (bytes for HTML, anything json.dumps accepts for JSON)
+    """
+    parts = urlparse(path)
+    route_path = parts.path.rstrip("/")
+    query = parse_qs(parts.query)
+
+    if route_path == "/wiki/Artifact/Sets":
+        return 200, "text/html; charset=UTF-8", data['artifact_html']
+    piece = data['artifact_pieces'].get(unquote(parts.path))
+    if piece is not None:
+        return 200, "text/html; charset=UTF-8", make_piece_page(piece, pad_bytes)
+
+    # gsi.fly.dev: characters?limit=&page=, banners?limit=&page=, characters/{id}, characters/{id}/media, banners/{id}
+    match = re.fullmatch(r"/(characters|banners)", route_path)
+    if match:
+        records = list(data[match.group(1)].values())
+        limit = int(query.get('limit', ['25'])[0])
+        page = int(query.get('page', ['1'])[0])
+        results = [pad(record, pad_bytes) for record in records[(page - 1) * limit:page * limit]]
+        return 200, "application/json", {'page': page, 'limit': limit, 'total': len(records), 'results': results}
+
+    match = re.fullmatch(r"/characters/(\d+)/media", route_path)
+    if match:
+        character = data['characters'].get(int(match.group(1)))
+        if character is None:
+            return 404, "application/json", {'result': {}}
+        return 200, "application/json", {'result': pad(make_media(character), pad_bytes)}
+
+    match = re.fullmatch(r"/(characters|banners)/(\d+)", route_path)
+    if match:
+        record = data[match.group(1)].get(int(match.group(2)))
+        if record is None:
+            return 404, "application/json", {'result': {}}
+        return 200, "application/json", {'result': pad(record, pad_bytes)}
+
+    # genshin.jmp.blue: weapons/ is a list of weapon IDs, weapons/{id}/ the weapon itself
+    if route_path == "/weapons":
+        return 200, "application/json", list(data['weapons']) + DUPLICATE_WEAPONS
+
+    match = re.fullmatch(r"/weapons/([\w-]+)", route_path)
+    if match and match.group(1) in data['weapons']:
+        return 200, "application/json", pad(data['weapons'][match.group(1)], pad_bytes)
+
+    return 404, "application/json", {'error': f"Not found: {parts.path}"}
+
+
+class MockUpstreamHandler(BaseHTTPRequestHandler):
+    """
+    Answers GET requests from the server's data, after the configured latency and error injection
+    """
+    def do_GET(self):
+        server = self.server
+        if self.path == "/_stats":
+            with server.lock:
+                stats = dict(server.stats)
+            return self.send_body(200, "application/json", stats, {})
+
+        with server.lock:
+            delay = server.latency + server.random.uniform(0, server.jitter)
+            fail = server.random.random() < server.error_rate
+            status = server.random.choice(ERROR_STATUSES) if fail else None
+            server.stats['requests'] += 1
+        time.sleep(delay)
+
+        if fail:
+            with server.lock:
+                server.stats['errors'] += 1
+            return self.send_body(status, "application/json", {'error': "Injected failure"}, {})
+
+        status, content_type, body = route(self.path, server.data, server.pad_bytes)
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+
+        # ETags let the response cache revalidate with 304s, like the real upstreams
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            with server.lock:
+                server.stats['not_modified'] += 1
+            return self.send_body(304, content_type, b"", {'ETag': etag})
+        self.send_body(status, content_type, body, {'ETag': etag} if status == 200 else {})
+
+    def send_body(self, status, content_type, body, headers):
+        """
+        Writes a response
+
+        ARGUMENTS:
+        status: int
+            HTTP status code
+        content_type: str
+            Content-Type header
+        body: bytes or object
+            The body, JSON encoded first if it is not bytes
+        headers: dict
+            Extra response headers
+
+        RETURNS:
+            None
+        """
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.stats['bytes_sent'] += len(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(host=HOST, port=PORT, latency=LATENCY, jitter=JITTER, error_rate=ERROR_RATE,
+                pad_bytes=PAD_BYTES, seed=SEED, verbose=False):
+    """
+    Creates the mock upstream server. Call serve_forever() on it (or run it in a thread) to start it
+
+    ARGUMENTS:
+    host: str
+        Address to listen on
+    port: int
+        Port to listen on. 0 picks a free port (see server.server_address)
+    latency: float
+        Seconds added to every response
+    jitter: float
+        Extra random latency, uniform between 0 and this many seconds
+    error_rate: float
+        Fraction of requests answered with a 429 or 503
+    pad_bytes: int
+        Filler bytes added to every JSON record
+    seed: int
+        Seed for jitter and error injection
+    verbose: bool
+        Whether to log every request
+
+    RETURNS:
+    server: ThreadingHTTPServer
+        The server, not started yet
+    """
+    server = ThreadingHTTPServer((host, port), MockUpstreamHandler)
+    server.daemon_threads = True
+    server.data = load_data()
+    server.latency = latency
+    server.jitter = jitter
+    server.error_rate = error_rate
+    server.pad_bytes = pad_bytes
+    server.random = random.Random(seed)
+    server.verbose = verbose
+    server.lock = threading.Lock()
+    server.stats = {'requests': 0, 'errors': 0, 'not_modified': 0, 'bytes_sent': 0}
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the GSHImpact, Genshin.dev and fandom wiki upstreams")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--latency", type=float, default=LATENCY, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=JITTER, help="extra random latency, up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=ERROR_RATE, help="fraction of requests answered with 429/503")
+    parser.add_argument("--pad-bytes", type=int, default=PAD_BYTES, help="filler bytes added to every JSON record")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency, args.jitter, args.error_rate,
+                         args.pad_bytes, args.seed, args.verbose)
+    host, port = server.server_address[:2]
+    print(f"Mock upstream listening on http://{host}:{port} (stats at /_stats)")
+    print(f"Point the fill scripts at it with GENSHIN_UPSTREAM=http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()